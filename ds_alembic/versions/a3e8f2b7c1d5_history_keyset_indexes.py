@@ -0,0 +1,91 @@
+"""history keyset indexes
+
+Revision ID: a3e8f2b7c1d5
+Revises: f9c1d4e6b8a3
+Create Date: 2026-10-18 18:24:10.381527
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e8f2b7c1d5'
+down_revision = 'f9c1d4e6b8a3'
+branch_labels = None
+depends_on = None
+
+
+LOGS = [('ds', 'ds_order_id'), ('cchannel', 'cchannel_order_id'), ('roof', 'roof_order_id')]
+
+
+def order_id(product, column):
+    return f"(SELECT {column} FROM {product}_order_logs WHERE transcation_id = t.id)"
+
+
+def detail(product):
+    return (
+        f"(SELECT jsonb_strip_nulls(to_jsonb(d) - 'id' - '{product}_order_logs_id') "
+        f"FROM {product}_order_logs l JOIN {product}_order_detail_logs d ON d.{product}_order_logs_id = l.id "
+        f"WHERE l.transcation_id = t.id)"
+    )
+
+
+# the log lookups are subqueries instead of joins, they only run for the rows a page keeps
+# and the transcations side can be read in (modified_at, id) order from its index.
+ORDER_HISTORY = f"""
+CREATE OR REPLACE VIEW order_history AS
+SELECT t.id, t.product_type, t.transcation_type, t.production_stage, t.previous_stage,
+       coalesce({', '.join(order_id(product, column) for product, column in LOGS)}) AS order_id,
+       coalesce({', '.join(detail(product) for product, _ in LOGS)}) AS detail,
+       t.modified_at
+FROM transcations t
+UNION ALL
+SELECT id, product_type, transcation_type, production_stage, previous_stage, order_id, detail, modified_at
+FROM order_audits
+"""
+
+
+def joined_detail(table, key):
+    return f"jsonb_strip_nulls(to_jsonb({table}) - 'id' - '{key}')"
+
+
+JOINED_ORDER_HISTORY = f"""
+CREATE OR REPLACE VIEW order_history AS
+SELECT t.id, t.product_type, t.transcation_type, t.production_stage, t.previous_stage,
+       coalesce(ds.ds_order_id, cc.cchannel_order_id, rf.roof_order_id) AS order_id,
+       coalesce({joined_detail('dsd', 'ds_order_logs_id')},
+                {joined_detail('ccd', 'cchannel_order_logs_id')},
+                {joined_detail('rfd', 'roof_order_logs_id')}) AS detail,
+       t.modified_at
+FROM transcations t
+LEFT JOIN ds_order_logs ds ON ds.transcation_id = t.id
+LEFT JOIN ds_order_detail_logs dsd ON dsd.ds_order_logs_id = ds.id
+LEFT JOIN cchannel_order_logs cc ON cc.transcation_id = t.id
+LEFT JOIN cchannel_order_detail_logs ccd ON ccd.cchannel_order_logs_id = cc.id
+LEFT JOIN roof_order_logs rf ON rf.transcation_id = t.id
+LEFT JOIN roof_order_detail_logs rfd ON rfd.roof_order_logs_id = rf.id
+UNION ALL
+SELECT id, product_type, transcation_type, production_stage, previous_stage, order_id, detail, modified_at
+FROM order_audits
+"""
+
+
+def upgrade():
+    # /stream/history reads both sides of the order_history view in (modified_at, id) order.
+    op.create_index('ix_transcations_modified_at_id', 'transcations', ['modified_at', 'id'], unique=False)
+    # made on every partition, the ones factory.audit_retention adds get it too.
+    op.create_index('ix_order_audits_modified_at_id', 'order_audits', ['modified_at', 'id'], unique=False)
+    # the lookups of the view, and the cascades of factory.move_audits.
+    for product, _ in LOGS:
+        op.create_index(op.f(f'ix_{product}_order_logs_transcation_id'), f'{product}_order_logs', ['transcation_id'], unique=False)
+        op.create_index(op.f(f'ix_{product}_order_detail_logs_{product}_order_logs_id'), f'{product}_order_detail_logs', [f'{product}_order_logs_id'], unique=False)
+    op.execute(ORDER_HISTORY)
+
+
+def downgrade():
+    op.execute(JOINED_ORDER_HISTORY)
+    for product, _ in LOGS:
+        op.drop_index(op.f(f'ix_{product}_order_detail_logs_{product}_order_logs_id'), table_name=f'{product}_order_detail_logs')
+        op.drop_index(op.f(f'ix_{product}_order_logs_transcation_id'), table_name=f'{product}_order_logs')
+    op.drop_index('ix_order_audits_modified_at_id', table_name='order_audits')
+    op.drop_index('ix_transcations_modified_at_id', table_name='transcations')
@@ -0,0 +1,42 @@
+"""order list indexes
+
+Revision ID: d2f7a9c4e6b1
+Revises: b6d1f8e3a9c2
+Create Date: 2026-10-18 21:42:17.503318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f7a9c4e6b1'
+down_revision = 'b6d1f8e3a9c2'
+branch_labels = None
+depends_on = None
+
+
+PRODUCTS = ['ds', 'cchannel', 'roof']
+
+
+def upgrade():
+    # built concurrently, the order tables take writes the whole time. that cannot run in a transaction,
+    # an index left invalid by a failed build has to be dropped before running this again.
+    with op.get_context().autocommit_block():
+        for product in PRODUCTS:
+            # the keyset of the order lists, only the orders not done yet.
+            op.create_index(f'ix_{product}_order_details_not_done', f'{product}_order_details', ['pick_up_time', f'{product}_order_id'], unique=False, postgresql_where=sa.text("production_stage <> 'done'"), postgresql_concurrently=True)
+            # the detail of an order, and the cascade of its delete.
+            op.create_index(op.f(f'ix_{product}_order_details_{product}_order_id'), f'{product}_order_details', [f'{product}_order_id'], unique=False, postgresql_concurrently=True)
+            # the orders of a customer or a manager, and the set null when a customer is deleted.
+            op.create_index(op.f(f'ix_{product}_orders_customer_id'), f'{product}_orders', ['customer_id'], unique=False, postgresql_concurrently=True)
+            op.create_index(op.f(f'ix_{product}_orders_manager_id'), f'{product}_orders', ['manager_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for product in PRODUCTS:
+            op.drop_index(op.f(f'ix_{product}_orders_manager_id'), table_name=f'{product}_orders', postgresql_concurrently=True)
+            op.drop_index(op.f(f'ix_{product}_orders_customer_id'), table_name=f'{product}_orders', postgresql_concurrently=True)
+            op.drop_index(op.f(f'ix_{product}_order_details_{product}_order_id'), table_name=f'{product}_order_details', postgresql_concurrently=True)
+            op.drop_index(f'ix_{product}_order_details_not_done', table_name=f'{product}_order_details', postgresql_concurrently=True)
@@ -0,0 +1,57 @@
+"""previous stage in audits
+
+Revision ID: e7b3c9f5a2d8
+Revises: c5d2e8a1f4b3
+Create Date: 2026-10-18 14:31:05.617420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3c9f5a2d8'
+down_revision = 'c5d2e8a1f4b3'
+branch_labels = None
+depends_on = None
+
+
+def detail(table, key):
+    return f"jsonb_strip_nulls(to_jsonb({table}) - 'id' - '{key}')"
+
+
+def order_history(previous_stage):
+    return f"""
+CREATE VIEW order_history AS
+SELECT t.id, t.product_type, t.transcation_type, t.production_stage,{' t.previous_stage,' if previous_stage else ''}
+       coalesce(ds.ds_order_id, cc.cchannel_order_id, rf.roof_order_id) AS order_id,
+       coalesce({detail('dsd', 'ds_order_logs_id')},
+                {detail('ccd', 'cchannel_order_logs_id')},
+                {detail('rfd', 'roof_order_logs_id')}) AS detail,
+       t.modified_at
+FROM transcations t
+LEFT JOIN ds_order_logs ds ON ds.transcation_id = t.id
+LEFT JOIN ds_order_detail_logs dsd ON dsd.ds_order_logs_id = ds.id
+LEFT JOIN cchannel_order_logs cc ON cc.transcation_id = t.id
+LEFT JOIN cchannel_order_detail_logs ccd ON ccd.cchannel_order_logs_id = cc.id
+LEFT JOIN roof_order_logs rf ON rf.transcation_id = t.id
+LEFT JOIN roof_order_detail_logs rfd ON rfd.roof_order_logs_id = rf.id
+UNION ALL
+SELECT id, product_type, transcation_type, production_stage,{' previous_stage,' if previous_stage else ''} order_id, detail, modified_at
+FROM order_audits
+"""
+
+
+def upgrade():
+    op.execute("DROP VIEW order_history")
+    op.add_column('transcations', sa.Column('previous_stage', postgresql.ENUM('pending', 'producing', 'done', name='productionstage', create_type=False), nullable=True))
+    op.add_column('order_audits', sa.Column('previous_stage', postgresql.ENUM('pending', 'producing', 'done', name='productionstage', create_type=False), nullable=True))
+    op.execute(order_history(previous_stage=True))
+
+
+def downgrade():
+    op.execute("DROP VIEW order_history")
+    op.drop_column('order_audits', 'previous_stage')
+    op.drop_column('transcations', 'previous_stage')
+    op.execute(order_history(previous_stage=False))
@@ -0,0 +1,121 @@
+"""partition order audits
+
+Revision ID: f9c1d4e6b8a3
+Revises: e7b3c9f5a2d8
+Create Date: 2026-10-18 16:02:47.933015
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f9c1d4e6b8a3'
+down_revision = 'e7b3c9f5a2d8'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = "id, product_type, transcation_type, production_stage, previous_stage, order_id, detail, modified_at"
+
+
+def detail(table, key):
+    return f"jsonb_strip_nulls(to_jsonb({table}) - 'id' - '{key}')"
+
+
+ORDER_HISTORY = f"""
+CREATE VIEW order_history AS
+SELECT t.id, t.product_type, t.transcation_type, t.production_stage, t.previous_stage,
+       coalesce(ds.ds_order_id, cc.cchannel_order_id, rf.roof_order_id) AS order_id,
+       coalesce({detail('dsd', 'ds_order_logs_id')},
+                {detail('ccd', 'cchannel_order_logs_id')},
+                {detail('rfd', 'roof_order_logs_id')}) AS detail,
+       t.modified_at
+FROM transcations t
+LEFT JOIN ds_order_logs ds ON ds.transcation_id = t.id
+LEFT JOIN ds_order_detail_logs dsd ON dsd.ds_order_logs_id = ds.id
+LEFT JOIN cchannel_order_logs cc ON cc.transcation_id = t.id
+LEFT JOIN cchannel_order_detail_logs ccd ON ccd.cchannel_order_logs_id = cc.id
+LEFT JOIN roof_order_logs rf ON rf.transcation_id = t.id
+LEFT JOIN roof_order_detail_logs rfd ON rfd.roof_order_logs_id = rf.id
+UNION ALL
+SELECT {COLUMNS}
+FROM order_audits
+"""
+
+# a partition per month from the oldest audit to two months ahead, named like order_audits_y2026m10.
+# factory.audit_retention keeps adding the months ahead.
+MONTHLY_PARTITIONS = """
+DO $$
+DECLARE month date;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', coalesce((SELECT min(modified_at) FROM order_audits_unpartitioned), now())),
+            date_trunc('month', now()) + interval '2 months',
+            interval '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF order_audits FOR VALUES FROM (%L) TO (%L)',
+            'order_audits_' || to_char(month, '"y"YYYY"m"MM'), month, month + interval '1 month'
+        );
+    END LOOP;
+END $$;
+"""
+
+
+def order_audits_columns():
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('transcations_id_seq')"), nullable=False),
+        sa.Column('product_type', postgresql.ENUM('ds', 'c_purlin', 'u_beam', 'i_beam', 'c_channel', 'hollow', 'plain', 'roof', name='product', create_type=False), nullable=False),
+        sa.Column('transcation_type', postgresql.ENUM('insert', 'update', 'delete', name='transtype', create_type=False), nullable=False),
+        sa.Column('production_stage', postgresql.ENUM('pending', 'producing', 'done', name='productionstage', create_type=False), nullable=False),
+        sa.Column('previous_stage', postgresql.ENUM('pending', 'producing', 'done', name='productionstage', create_type=False), nullable=True),
+        sa.Column('order_id', sa.Integer(), nullable=True),
+        sa.Column('detail', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('modified_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    ]
+
+
+def upgrade():
+    op.execute("DROP VIEW order_history")
+    op.rename_table('order_audits', 'order_audits_unpartitioned')
+    op.execute("ALTER TABLE order_audits_unpartitioned RENAME CONSTRAINT order_audits_pkey TO order_audits_unpartitioned_pkey")
+    # the partition key has to be in the primary key.
+    op.create_table('order_audits',
+    *order_audits_columns(),
+    sa.PrimaryKeyConstraint('id', 'modified_at'),
+    postgresql_partition_by='RANGE (modified_at)'
+    )
+    op.execute(MONTHLY_PARTITIONS)
+    # anything outside the monthly partitions, kept empty by creating the months ahead of time.
+    op.execute("CREATE TABLE order_audits_default PARTITION OF order_audits DEFAULT")
+    op.execute(f"INSERT INTO order_audits ({COLUMNS}) SELECT {COLUMNS} FROM order_audits_unpartitioned")
+    op.drop_table('order_audits_unpartitioned')
+    op.execute(ORDER_HISTORY)
+    op.create_table('order_audit_days',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('product_type', postgresql.ENUM('ds', 'c_purlin', 'u_beam', 'i_beam', 'c_channel', 'hollow', 'plain', 'roof', name='product', create_type=False), nullable=False),
+    sa.Column('transcation_type', postgresql.ENUM('insert', 'update', 'delete', name='transtype', create_type=False), nullable=False),
+    sa.Column('production_stage', postgresql.ENUM('pending', 'producing', 'done', name='productionstage', create_type=False), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'product_type', 'transcation_type', 'production_stage')
+    )
+
+
+def downgrade():
+    # detached partitions are not brought back, their rows only live in order_audit_days.
+    op.drop_table('order_audit_days')
+    op.execute("DROP VIEW order_history")
+    op.rename_table('order_audits', 'order_audits_partitioned')
+    op.execute("ALTER TABLE order_audits_partitioned RENAME CONSTRAINT order_audits_pkey TO order_audits_partitioned_pkey")
+    op.create_table('order_audits',
+    *order_audits_columns(),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(f"INSERT INTO order_audits ({COLUMNS}) SELECT {COLUMNS} FROM order_audits_partitioned")
+    # the partitions go with their parent.
+    op.drop_table('order_audits_partitioned')
+    op.execute(ORDER_HISTORY)
@@ -0,0 +1,82 @@
+"""The asyncpg engine and sessions of the order routers, imported only when db_async is on.
+
+an AsyncSession runs the sync session class of SessionLocal underneath, so the audit listeners,
+models.receive_do_orm_execute and the order events work the same on both.
+"""
+import asyncio
+
+from fastapi import Request, Response
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from factory.config import settings
+from factory.database import SessionLocal, TimedQueuePool, reads_replica, replica
+
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{settings.db_username}:{settings.db_password}@{settings.db_hostname}:{settings.db_port}/{settings.db_name}"
+ASYNC_REPLICA_DATABASE_URL = f"postgresql+asyncpg://{settings.db_username}:{settings.db_password}@{settings.db_replica_hostname}:{settings.db_replica_port or settings.db_port}/{settings.db_name}"
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """the checkout waits of the async pool, reported like the ones of the sync pool."""
+
+
+def create_pooled_engine(url: str, **connect_args):
+    return create_async_engine(
+        url,
+        poolclass=TimedAsyncQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={
+            "server_settings": {
+                "statement_timeout": str(settings.db_statement_timeout_ms)
+            },
+            **connect_args,
+        },
+    )
+
+
+async_engine = create_pooled_engine(ASYNC_DATABASE_URL)
+async_replica_engine = None
+if settings.db_replica_hostname:
+    async_replica_engine = create_pooled_engine(
+        ASYNC_REPLICA_DATABASE_URL, timeout=settings.db_replica_connect_timeout
+    )
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    sync_session_class=SessionLocal.class_,
+    autoflush=False,
+    # nothing can load lazily once the endpoint returned, like while the response model reads the order.
+    expire_on_commit=False,
+)
+
+
+async def replica_session() -> AsyncSession:
+    db = AsyncSessionLocal(bind=async_replica_engine)
+    try:
+        # checks out the connection now, a replica that is down fails here instead of in the route.
+        await db.connection()
+    except exc.TimeoutError:
+        # every connection of the replica is busy, it is still up.
+        await db.close()
+        return AsyncSessionLocal()
+    except (exc.DBAPIError, OSError, asyncio.TimeoutError):
+        await db.close()
+        replica.failed()
+        return AsyncSessionLocal()
+    return db
+
+
+async def get_db(request: Request, response: Response):
+    # routed like database.get_db.
+    if async_replica_engine is not None and reads_replica(request, response):
+        db = await replica_session()
+    else:
+        db = AsyncSessionLocal()
+    async with db:
+        yield db
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from typing import NamedTuple
+
+from sqlalchemy import Sequence, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from factory.config import settings
+from factory.database import SessionLocal, engine, run_db
+
+logger = logging.getLogger(__name__)
+
+# audit records waiting in session.info for the commit.
+PENDING_AUDIT = "pending_audit_records"
+
+
+class AuditRow(NamedTuple):
+    model: type
+    values: dict
+    # column of this row that takes the id of the row before it in the record.
+    parent_key: str | None = None
+
+
+class AuditWriter:
+    """Writes the audit records of the mapper listeners.
+
+    "sync" inserts them in the transaction of the change they record, one row at a time.
+    "buffered" queues them once the transaction commits and a background task inserts them in batches,
+    when audit_batch_size records are waiting or every audit_flush_interval_ms. a batch the database refuses
+    goes back to the front and is retried with backoff, records are only dropped past audit_max_pending
+    or when stopping. a crash loses what is queued, about audit_flush_interval_ms worth of records,
+    and up to audit_max_pending of them while the database is away.
+    """
+
+    def __init__(
+        self,
+        mode: str = settings.audit_mode,
+        batch_size: int = settings.audit_batch_size,
+        flush_interval_ms: int = settings.audit_flush_interval_ms,
+        retry_max_ms: int = settings.audit_retry_max_ms,
+        max_pending: int = settings.audit_max_pending,
+    ):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.retry_max = retry_max_ms / 1000
+        self.max_pending = max_pending
+        # (queued at, record) in commit order.
+        self.pending: deque[tuple[float, list[AuditRow]]] = deque()
+        self.full: asyncio.Event | None = None
+        self.stopped: asyncio.Event | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.task: asyncio.Task | None = None
+        self.batch_sizes: deque[int] = deque(maxlen=256)
+        self.lags: deque[float] = deque(maxlen=256)
+        self.written = 0
+        self.lost = 0
+        self.retries = 0
+
+    async def start(self):
+        if self.mode != "buffered":
+            return
+        self.loop = asyncio.get_running_loop()
+        self.full = asyncio.Event()
+        self.stopped = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        # the batch being inserted is finished first, not cancelled on its thread.
+        self.stopped.set()
+        self.full.set()
+        await self.task
+        self.task = None
+        # graceful shutdown writes everything that was committed, what the database still refuses is lost.
+        while self.pending:
+            if not await self.flush():
+                self.drop(len(self.pending))
+        self.loop = None
+
+    def write(self, session: Session, record: list[AuditRow]):
+        if self.mode != "buffered":
+            self.insert(session.connection(), record)
+            return
+        session.info.setdefault(PENDING_AUDIT, []).append(record)
+
+    def insert(self, connection, record: list[AuditRow]):
+        parent_id = None
+        for row in record:
+            values = dict(row.values)
+            if row.parent_key is not None:
+                values[row.parent_key] = parent_id
+            parent_id = connection.execute(
+                insert(row.model)
+                .values(values)
+                .returning(*inspect(row.model).primary_key)
+            ).scalar_one()
+
+    def dispatch(self, records: list[list[AuditRow]]):
+        if self.loop is None:
+            # no writer running, like in a script, so write them on the spot.
+            self.insert_many(records)
+            return
+        # sync endpoints commit on the threadpool, so hand over to the loop.
+        self.loop.call_soon_threadsafe(self.enqueue, records)
+
+    def enqueue(self, records: list[list[AuditRow]]):
+        queued_at = time.perf_counter()
+        self.pending.extend((queued_at, record) for record in records)
+        if len(self.pending) > self.max_pending:
+            # the database has been away for a while, the oldest go first.
+            self.drop(len(self.pending) - self.max_pending)
+        if len(self.pending) >= self.batch_size:
+            self.full.set()
+
+    def drop(self, count: int):
+        for _ in range(count):
+            self.pending.popleft()
+        self.lost += count
+        logger.error("lost %s audit records.", count)
+
+    async def run(self):
+        backoff = 0
+        while not self.stopped.is_set():
+            try:
+                await asyncio.wait_for(self.full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.full.clear()
+            while self.pending and not self.stopped.is_set():
+                if await self.flush():
+                    backoff = 0
+                    continue
+                backoff = min(backoff * 2 or self.flush_interval, self.retry_max)
+                try:
+                    # stop does not wait the backoff out.
+                    await asyncio.wait_for(self.stopped.wait(), backoff)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def flush(self) -> bool:
+        """writes the oldest batch, it stays at the front of pending when the insert fails."""
+        batch = [
+            self.pending.popleft()
+            for _ in range(min(self.batch_size, len(self.pending)))
+        ]
+        try:
+            await run_db(self.insert_many, [record for _, record in batch])
+        except Exception:
+            # the records queued meanwhile went behind it, the order of the commits is kept.
+            self.pending.extendleft(reversed(batch))
+            self.retries += 1
+            logger.exception("could not write %s audit records, retrying.", len(batch))
+            return False
+        flushed_at = time.perf_counter()
+        self.batch_sizes.append(len(batch))
+        self.lags.append(flushed_at - batch[0][0])
+        self.written += len(batch)
+        return True
+
+    def insert_many(self, records: list[list[AuditRow]]):
+        """one multi-row insert per table, the ids are taken from the sequences first to link the rows."""
+        with engine.begin() as connection:
+            ids = [[None] * len(record) for record in records]
+            rows = defaultdict(list)
+            for index, record in enumerate(records):
+                for position, row in enumerate(record):
+                    rows[position, row.model].append((index, row))
+            for (position, model), model_rows in sorted(
+                rows.items(), key=lambda item: item[0][0]
+            ):
+                primary_key = inspect(model).primary_key[0]
+                sequence = (
+                    primary_key.default.name
+                    if isinstance(primary_key.default, Sequence)
+                    else func.pg_get_serial_sequence(
+                        model.__tablename__, primary_key.name
+                    )
+                )
+                new_ids = connection.execute(
+                    select(func.nextval(sequence)).select_from(
+                        func.generate_series(1, len(model_rows))
+                    )
+                ).scalars()
+                values = []
+                for (index, row), new_id in zip(model_rows, new_ids):
+                    ids[index][position] = new_id
+                    row_values = {**row.values, primary_key.key: new_id}
+                    if row.parent_key is not None:
+                        row_values[row.parent_key] = ids[index][position - 1]
+                    values.append(row_values)
+                connection.execute(insert(model), values)
+
+    def metrics(self) -> dict:
+        batch_sizes = list(self.batch_sizes)
+        lags = list(self.lags)
+        return {
+            "audit_pending": len(self.pending),
+            "audit_written": self.written,
+            "audit_lost": self.lost,
+            "audit_retries": self.retries,
+            "audit_batch_size_avg": sum(batch_sizes) / len(batch_sizes)
+            if batch_sizes
+            else 0,
+            "audit_batch_size_max": max(batch_sizes, default=0),
+            "audit_lag_avg_ms": sum(lags) / len(lags) * 1000 if lags else 0,
+            "audit_lag_max_ms": max(lags, default=0) * 1000,
+        }
+
+
+audit_writer = AuditWriter()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def dispatch_audit_records(session: Session):
+    records = session.info.pop(PENDING_AUDIT, None)
+    if records:
+        audit_writer.dispatch(records)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def discard_audit_records(session: Session):
+    session.info.pop(PENDING_AUDIT, None)
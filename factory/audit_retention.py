@@ -0,0 +1,105 @@
+"""Keeps audit_retention_months of monthly order_audits partitions.
+
+adds the partitions of the coming months, rolls the older ones up into order_audit_days and detaches them.
+run it once a day, from cron for example: python -m factory.audit_retention [--drop]
+with --drop the detached partitions are dropped, otherwise they stay as plain tables to archive.
+"""
+import re
+import sys
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from factory.config import settings
+from factory.database import engine
+
+PARTITION_NAME = re.compile(r"order_audits_y(\d{4})m(\d{2})")
+MONTHS_AHEAD = 2
+
+PARTITIONS = text(
+    """
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'order_audits'::regclass
+    """
+)
+
+ROLL_UP = """
+    INSERT INTO order_audit_days (day, product_type, transcation_type, production_stage, count)
+    SELECT modified_at::date, product_type, transcation_type, production_stage, count(*)
+    FROM {partition}
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (day, product_type, transcation_type, production_stage)
+    DO UPDATE SET count = order_audit_days.count + excluded.count
+"""
+
+
+def add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"order_audits_y{month.year}m{month.month:02}"
+
+
+def monthly_partitions(connection: Connection) -> dict[date, str]:
+    partitions = {}
+    for name in connection.execute(PARTITIONS).scalars():
+        if match := PARTITION_NAME.fullmatch(name):
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def this_month(connection: Connection) -> date:
+    # the month of the database clock, the one the partition bounds are read in.
+    return connection.execute(text("SELECT date_trunc('month', now())::date")).scalar()
+
+
+def create_partitions(months_ahead: int = MONTHS_AHEAD) -> list[str]:
+    created = []
+    with engine.begin() as connection:
+        current = this_month(connection)
+        existing = monthly_partitions(connection)
+        for months in range(months_ahead + 1):
+            month = add_months(current, months)
+            if month in existing:
+                continue
+            connection.execute(
+                text(
+                    f"CREATE TABLE {partition_name(month)} PARTITION OF order_audits "
+                    f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+                )
+            )
+            created.append(partition_name(month))
+    return created
+
+
+def retire_partitions(
+    keep_months: int = settings.audit_retention_months, drop: bool = False
+) -> list[str]:
+    """rolls up and detaches every partition older than keep_months, one transaction each."""
+    with engine.connect() as connection:
+        cutoff = add_months(this_month(connection), -keep_months)
+        old = [
+            name
+            for month, name in sorted(monthly_partitions(connection).items())
+            if month < cutoff
+        ]
+    for name in old:
+        # the counts and the detach commit together, so /stream/check never counts a day twice or not at all.
+        with engine.begin() as connection:
+            connection.execute(text(ROLL_UP.format(partition=name)))
+            connection.execute(
+                text(f"ALTER TABLE order_audits DETACH PARTITION {name}")
+            )
+            if drop:
+                connection.execute(text(f"DROP TABLE {name}"))
+    return old
+
+
+if __name__ == "__main__":
+    for name in create_partitions():
+        print(f"created {name}.")
+    for name in retire_partitions(drop="--drop" in sys.argv[1:]):
+        print(f"rolled up and detached {name}.")
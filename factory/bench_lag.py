@@ -0,0 +1,98 @@
+"""Sends concurrent requests to an async endpoint that queries and reports how long the event loop stalled.
+
+python -m factory.bench_lag [requests] [query_delay_ms] [port]
+
+the app runs in this process on uvicorn and every query it sends waits query_delay_ms first, like a slow database.
+the lag is how late a 10ms sleep on the loop of the server wakes up while the requests run.
+it does not need loop_monitor, so a checkout from before run_db gives the numbers to compare with.
+a loop that never comes free again records no lag at all, the requests not finished within 60s tell that one.
+"""
+import asyncio
+import sys
+import threading
+import time
+
+import uvicorn
+from sqlalchemy import event
+
+from factory import oauth2
+from factory.database import engine
+from factory.bench_load import read_response
+from factory.main import app
+from factory.schema import token_schema
+from factory.utils import ManagerType
+
+# a detail that does not exist, the route still queries for it before its 404.
+PATH = "/cchannel/get/image/0"
+
+
+def serve(port: int) -> tuple[uvicorn.Server, asyncio.AbstractEventLoop]:
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    loop = asyncio.new_event_loop()
+    threading.Thread(
+        target=loop.run_until_complete, args=(server.serve(),), daemon=True
+    ).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, loop
+
+
+async def probe(lags: list[float], interval: float = 0.01):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def request(port: int, token: str) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"GET {PATH} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+        f"Authorization: Bearer {token}\r\n\r\n".encode()
+    )
+    status_code = await read_response(reader)
+    writer.close()
+    return status_code
+
+
+async def burst(port: int, requests: int, timeout: float = 60) -> dict:
+    token = oauth2.create_access_token(
+        token_schema.PayloadDataCreate(manager_id=1, manager_type=ManagerType.admin)
+    )
+    started = time.perf_counter()
+    try:
+        status_codes = await asyncio.wait_for(
+            asyncio.gather(*(request(port, token) for _ in range(requests))), timeout
+        )
+    except asyncio.TimeoutError:
+        status_codes = []
+    return {
+        "elapsed_s": time.perf_counter() - started,
+        "finished": len(status_codes),
+        "errors": sum(status_code >= 500 for status_code in status_codes),
+    }
+
+
+def lag_test(requests: int = 40, query_delay: float = 0.05, port: int = 8765) -> dict:
+    @event.listens_for(engine, "before_cursor_execute")
+    def slow_query(*args):
+        time.sleep(query_delay)
+
+    server, loop = serve(port)
+    lags: list[float] = []
+    prober = asyncio.run_coroutine_threadsafe(probe(lags), loop)
+    try:
+        result = asyncio.run(burst(port, requests))
+    finally:
+        loop.call_soon_threadsafe(prober.cancel)
+        server.should_exit = True
+        event.remove(engine, "before_cursor_execute", slow_query)
+    return {**result, "loop_lag_max_ms": max(lags, default=0) * 1000}
+
+
+if __name__ == "__main__":
+    requests, query_delay, port = [*sys.argv[1:], 40, 50, 8765][:3]
+    result = lag_test(int(requests), float(query_delay) / 1000, int(port))
+    print(", ".join(f"{key} {value:.2f}" for key, value in result.items()))
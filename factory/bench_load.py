@@ -0,0 +1,89 @@
+"""Keeps the order lists busy from a number of clients and reports the requests per second and p99.
+
+python -m factory.bench_load http://127.0.0.1:8000 [clients] [seconds]
+
+run it once against a server with db_async off and once with it on to compare the two.
+every client keeps its connection open, like the tablets on the floor, so the numbers are the ones of the server.
+
+both paths run the same three queries per list. one uvicorn worker, pages of 500 orders, 20s per run:
+    8 clients:  sync 13.4-14.2 rps, p99 1.5s   async 11.8-11.9 rps, p99 1.9s
+    32 clients: sync 9.6-10.5 rps, p99 7.7-8.1s   async 10.8-11.9 rps, p99 6.6s
+the time goes into building the responses, not into waiting on postgres, so db_async stays off by default.
+"""
+import asyncio
+import sys
+import time
+from urllib.parse import urlsplit
+
+from factory import oauth2
+from factory.schema import token_schema
+from factory.utils import ManagerType
+
+PATHS = ["/ds/orders/all", "/roof/orders/all", "/cchannel/orders/all"]
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status_code = int(lines[0].split(" ")[1])
+    headers = dict(line.lower().split(": ", 1) for line in lines[1:] if line)
+    await reader.readexactly(int(headers.get("content-length", 0)))
+    return status_code
+
+
+async def client(
+    host: str, port: int, token: str, until: float, latencies: list[float]
+) -> int:
+    reader, writer = await asyncio.open_connection(host, port)
+    errors = 0
+    i = 0
+    while time.perf_counter() < until:
+        request = (
+            f"GET {PATHS[i % len(PATHS)]} HTTP/1.1\r\n"
+            f"Host: {host}\r\nAuthorization: Bearer {token}\r\n\r\n"
+        )
+        i += 1
+        started = time.perf_counter()
+        writer.write(request.encode())
+        if await read_response(reader) != 200:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+    writer.close()
+    return errors
+
+
+async def load_test(url: str, clients: int = 32, seconds: float = 20) -> dict:
+    address = urlsplit(url)
+    token = oauth2.create_access_token(
+        token_schema.PayloadDataCreate(manager_id=1, manager_type=ManagerType.admin)
+    )
+    latencies: list[float] = []
+    started = time.perf_counter()
+    errors = await asyncio.gather(
+        *(
+            client(
+                address.hostname,
+                address.port or 80,
+                token,
+                started + seconds,
+                latencies,
+            )
+            for _ in range(clients)
+        )
+    )
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    url, *args = sys.argv[1:]
+    clients, seconds = [*args, 32, 20][:2]
+    result = asyncio.run(load_test(url, int(clients), float(seconds)))
+    print(", ".join(f"{key} {value:.1f}" for key, value in result.items()))
@@ -0,0 +1,142 @@
+"""Rebuilds the order board of a past moment from order_history.
+
+every run keeps the board of a minute ago as a checkpoint, the board of a moment is then the nearest
+checkpoint before it plus the order changes in between.
+run it every hour, from cron for example: python -m factory.board
+boards before the oldest checkpoint need order_history to reach back to them, see audit_retention_months.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from factory import models, utils
+from factory.config import settings
+from factory.database import SessionLocal
+
+# order changes fetched per round trip of the replay.
+REPLAY_BATCH = 5000
+
+
+class OrderBoard:
+    """Orders per product and stage, and the orders not done yet, as of a moment."""
+
+    def __init__(self, at: datetime | None = None):
+        # the last moment replayed, None before the first order change.
+        self.at = at
+        self.checkpoint_at = at
+        self.counts: dict[
+            tuple[utils.Product, utils.ProductionStage], int
+        ] = defaultdict(int)
+        self.orders: dict[tuple[utils.Product, int], utils.ProductionStage] = {}
+        self.replayed = 0
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint: models.OrderBoardCheckpoint) -> "OrderBoard":
+        board = cls(checkpoint.taken_at)
+        for product, stage, count in checkpoint.counts:
+            board.counts[(utils.Product[product], utils.ProductionStage[stage])] = count
+        for product, order_id, stage in checkpoint.orders:
+            board.orders[(utils.Product[product], order_id)] = utils.ProductionStage[
+                stage
+            ]
+        return board
+
+    def checkpoint(self) -> models.OrderBoardCheckpoint:
+        return models.OrderBoardCheckpoint(
+            taken_at=self.at,
+            counts=[
+                [product.name, stage.name, count]
+                for (product, stage), count in self.counts.items()
+                if count
+            ],
+            orders=[
+                [product.name, order_id, stage.name]
+                for (product, order_id), stage in self.orders.items()
+            ],
+        )
+
+    def apply(
+        self,
+        product: utils.Product,
+        transcation_type: utils.TransType,
+        stage: utils.ProductionStage,
+        previous_stage: utils.ProductionStage | None,
+        order_id: int,
+    ):
+        key = (product, order_id)
+        if transcation_type == utils.TransType.insert:
+            self.counts[(product, stage)] += 1
+        elif transcation_type == utils.TransType.delete:
+            self.counts[(product, self.orders.pop(key, stage))] -= 1
+            return
+        else:
+            # an order off the board is done, the old logs have no previous stage to say so.
+            previous = (
+                self.orders.get(key) or previous_stage or utils.ProductionStage.done
+            )
+            self.counts[(product, previous)] -= 1
+            self.counts[(product, stage)] += 1
+        if stage == utils.ProductionStage.done:
+            self.orders.pop(key, None)
+        else:
+            self.orders[key] = stage
+
+    def replay(self, db: Session, until: datetime):
+        """applies the order changes after self.at up to until, oldest first."""
+        history = models.OrderHistory
+        query = db.query(
+            history.product_type,
+            history.transcation_type,
+            history.production_stage,
+            history.previous_stage,
+            history.order_id,
+        ).filter(history.modified_at <= until, history.order_id.isnot(None))
+        if self.at is not None:
+            query = query.filter(history.modified_at > self.at)
+        # a server side cursor, months of changes never sit in memory at once.
+        for row in query.order_by(history.modified_at, history.id).yield_per(
+            REPLAY_BATCH
+        ):
+            self.apply(*row)
+            self.replayed += 1
+        self.at = until
+
+    def open_orders(self) -> dict[str, int]:
+        """not done orders per product, keyed by the product value like OrderCount."""
+        result = defaultdict(int)
+        for product, _ in self.orders:
+            result[product.value] += 1
+        return dict(result)
+
+
+def board_at(db: Session, moment: datetime) -> OrderBoard:
+    checkpoint = (
+        db.query(models.OrderBoardCheckpoint)
+        .filter(models.OrderBoardCheckpoint.taken_at <= moment)
+        .order_by(models.OrderBoardCheckpoint.taken_at.desc())
+        .first()
+    )
+    board = OrderBoard.from_checkpoint(checkpoint) if checkpoint else OrderBoard()
+    board.replay(db, moment)
+    return board
+
+
+def take_checkpoint() -> OrderBoard:
+    # modified_at is stamped before the commit, the lag leaves the changes still in flight time to land.
+    moment = datetime.now().astimezone(utils.LOCAL_TIME_ZONE) - timedelta(
+        seconds=settings.board_checkpoint_lag
+    )
+    with SessionLocal() as db:
+        board = board_at(db, moment)
+        db.add(board.checkpoint())
+        db.commit()
+    return board
+
+
+if __name__ == "__main__":
+    board = take_checkpoint()
+    print(
+        f"checkpoint at {board.at}, {len(board.orders)} open orders, "
+        f"{board.replayed} order changes replayed since {board.checkpoint_at}."
+    )
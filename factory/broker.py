@@ -0,0 +1,36 @@
+"""Relays order events between the workers of one machine when event_bus is "unix".
+
+run it next to uvicorn: python -m factory.broker
+"""
+import asyncio
+import os
+
+from factory.config import settings
+
+writers: set[asyncio.StreamWriter] = set()
+
+
+async def relay(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    writers.add(writer)
+    try:
+        while line := await reader.readline():
+            # every worker gets it, the sender included.
+            for other in list(writers):
+                other.write(line)
+    except ConnectionError:
+        pass
+    finally:
+        writers.discard(writer)
+        writer.close()
+
+
+async def serve(path: str):
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(relay, path=path)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(settings.event_broker_path))
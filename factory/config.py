@@ -12,6 +12,77 @@ class Settings(BaseSettings):
     access_token_expire_min: int
     refresh_token_expire_day: int
     stream_delay_time: int
+    # connections kept open per process, and the extra ones opened when they are all busy.
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    # seconds a checkout waits for a free connection before it fails.
+    db_pool_timeout: int = 30
+    # seconds before a connection is replaced, -1 keeps them for good.
+    db_pool_recycle: int = 1800
+    # checks a connection with a round trip before handing it out, a restarted database costs no failed request.
+    db_pool_pre_ping: bool = True
+    # milliseconds a single statement may run, 0 for no limit. the scripts like factory.verify_counts share it.
+    db_statement_timeout_ms: int = 0
+    # the order routers of ds, roof and c channel on asyncpg, see factory.async_database.
+    # the pool settings above apply to each engine.
+    db_async: bool = False
+    # a streaming replica for the routes declared with database.read_only, unset they read the primary.
+    db_replica_hostname: str | None = None
+    db_replica_port: str | None = None
+    # seconds a client reads the primary after its own write, longer than the replica usually lags behind.
+    db_replica_read_after_write: int = 10
+    # seconds the reads stay on the primary after the replica failed to connect.
+    db_replica_retry_interval: int = 30
+    db_replica_connect_timeout: int = 2
+    # "push" waits for order events, "poll" re-counts every stream_delay_time seconds.
+    stream_mode: str = "push"
+    # "postgres" uses LISTEN/NOTIFY, "unix" the broker of factory.broker,
+    # "local" keeps the events inside the process (tests).
+    event_bus: str = "postgres"
+    event_broker_path: str = "/tmp/erg_order_events.sock"
+    # order events a worker keeps while the broker is away, past that every worker resyncs when it is back.
+    event_unsent_size: int = 1000
+    # outbound messages kept per listener before the overflow policy applies.
+    stream_queue_size: int = 8
+    # "coalesce" keeps only the newest message for a slow listener, "drop" disconnects it.
+    stream_overflow_policy: str = "coalesce"
+    # changes kept for listeners that reconnect with their last seq.
+    stream_history_size: int = 256
+    # a dead websocket is found by the ping frames of uvicorn, --ws-ping-interval and --ws-ping-timeout (20s each).
+    # listeners that connect with heartbeat=true also get {"type": "ping"} every heartbeat interval
+    # and are closed after idle_timeout seconds without a pong.
+    stream_heartbeat_interval: int = 20
+    stream_idle_timeout: int = 60
+    stream_max_connections: int = 1000
+    # listeners of one manager token, a websocket without a token only counts toward stream_max_connections.
+    stream_max_connections_per_manager: int = 20
+    # seconds of silence before an SSE listener gets a keep-alive comment.
+    sse_keepalive_time: int = 15
+    # threads for the session work of async endpoints, see database.run_db.
+    db_thread_pool_size: int = 8
+    # "sync" writes the audit logs in the transaction of the order, "buffered" writes them in batches
+    # after the commit. if the process dies it loses the ones queued, about audit_flush_interval_ms of them,
+    # or up to audit_max_pending while the database is away.
+    audit_mode: str = "sync"
+    audit_batch_size: int = 200
+    audit_flush_interval_ms: int = 100
+    # a batch the database refuses is retried, waiting twice as long each time up to audit_retry_max_ms.
+    # past audit_max_pending records waiting the oldest are dropped.
+    audit_retry_max_ms: int = 5000
+    audit_max_pending: int = 100000
+    # "tables" writes a transcation, an order log and a detail log per order change,
+    # "jsonb" one order_audits row. /stream/check reads both through the order_history view.
+    audit_format: str = "tables"
+    # months of raw order_audits kept, older partitions are rolled up into order_audit_days and detached.
+    audit_retention_months: int = 12
+    # rows per page of /stream/history, and per query of its ndjson export.
+    history_page_size: int = 100
+    history_max_page_size: int = 1000
+    # orders per page of the order lists and searches, the next page is in their X-Next-Cursor header.
+    orders_page_size: int = 500
+    orders_max_page_size: int = 1000
+    # seconds a board checkpoint stays behind the clock, see factory.board.
+    board_checkpoint_lag: int = 60
     # in the config file, the name of the parameters above has to be the same.
     class Config:
         env_file = ".env"
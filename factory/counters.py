@@ -0,0 +1,149 @@
+import threading
+from collections import defaultdict
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from factory import models, utils
+from factory.database import SessionLocal, run_db
+from factory.events import order_bus
+from factory.schema.stream_schema import OrderEvent
+
+
+class TransactionSnapshot:
+    """The xmin, xmax and in-progress ids of txid_current_snapshot()."""
+
+    def __init__(self, snapshot: str):
+        xmin, xmax, in_progress = snapshot.split(":")
+        self.xmin = int(xmin)
+        self.xmax = int(xmax)
+        self.in_progress = {int(txid) for txid in in_progress.split(",") if txid}
+
+    def sees(self, txid: int | None) -> bool:
+        """whether the transaction txid had committed when the snapshot was taken."""
+        if txid is None:
+            return False
+        return txid < self.xmin or (txid < self.xmax and txid not in self.in_progress)
+
+
+class OrderCounter:
+    """Orders per product and production stage, rebuilt at startup and moved by every order event.
+
+    the stream and /stream/check read from here instead of scanning transcations.
+    the events of the transactions a rebuild already saw are skipped, the others are counted on top of it
+    even when they came in while it was counting.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts: dict[
+            tuple[utils.Product, utils.ProductionStage], int
+        ] = defaultdict(int)
+        # inserts and deletes in transcations, what /stream/check reports.
+        self.transcations = 0
+        # the postgres snapshot the last rebuild counted in, its events are not counted again.
+        self.snapshot: TransactionSnapshot | None = None
+        # the events that came in while a rebuild was counting, applied again on top of it.
+        self.rebuilding: list[OrderEvent] | None = None
+
+    def rebuild(self, db: Session):
+        with self.lock:
+            self.rebuilding = []
+        try:
+            counts, transcations, snapshot = self.count_all(db)
+        except Exception:
+            with self.lock:
+                self.rebuilding = None
+            raise
+        with self.lock:
+            self.counts = counts
+            self.transcations = transcations
+            self.snapshot = snapshot
+            order_events, self.rebuilding = self.rebuilding, None
+            # only the ones committed after the snapshot are still missing from the counts.
+            for order_event in order_events:
+                self.count(order_event)
+
+    def count_all(self, db: Session):
+        # every count reads the same snapshot, the one the events are checked against.
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        snapshot = TransactionSnapshot(
+            db.execute(select(func.txid_current_snapshot())).scalar()
+        )
+        counts = defaultdict(int)
+        for product, details in models.ORDER_DETAILS.items():
+            rows = (
+                db.query(details.production_stage, func.count(details.id))
+                .group_by(details.production_stage)
+                .all()
+            )
+            for stage, count in rows:
+                counts[(product, stage)] = count
+        transcations = (
+            db.query(func.count(models.OrderHistory.id))
+            .filter(models.OrderHistory.transcation_type != utils.TransType.update)
+            .scalar()
+        )
+        # the audits of detached partitions only remain as daily counts.
+        transcations += (
+            db.query(func.coalesce(func.sum(models.OrderAuditDay.count), 0))
+            .filter(models.OrderAuditDay.transcation_type != utils.TransType.update)
+            .scalar()
+        )
+        return counts, transcations, snapshot
+
+    def apply(self, order_event: OrderEvent):
+        with self.lock:
+            if self.rebuilding is not None:
+                self.rebuilding.append(order_event)
+            self.count(order_event)
+
+    def count(self, order_event: OrderEvent):
+        if self.snapshot is not None and self.snapshot.sees(order_event.txid):
+            return
+        product = utils.Product(order_event.product_type)
+        stage = utils.ProductionStage(order_event.production_stage)
+        transcation_type = utils.TransType(order_event.transcation_type)
+        if transcation_type == utils.TransType.insert:
+            self.counts[(product, stage)] += 1
+            self.transcations += 1
+        elif transcation_type == utils.TransType.delete:
+            self.counts[(product, stage)] -= 1
+            self.transcations += 1
+        elif order_event.previous_stage is not None:
+            previous = utils.ProductionStage(order_event.previous_stage)
+            self.counts[(product, previous)] -= 1
+            self.counts[(product, stage)] += 1
+
+    def get(self, product: utils.Product, stage: utils.ProductionStage) -> int:
+        with self.lock:
+            return self.counts.get((product, stage), 0)
+
+    def open_orders(self) -> dict[str, int]:
+        """not done orders per product, keyed by the product value like OrderCount."""
+        result = defaultdict(int)
+        with self.lock:
+            for (product, stage), count in self.counts.items():
+                if stage != utils.ProductionStage.done and count:
+                    result[product.value] += count
+        return dict(result)
+
+
+order_counter = OrderCounter()
+order_bus.add_handler(order_counter.apply)
+
+
+def rebuild_order_counter():
+    db = SessionLocal()
+    try:
+        order_counter.rebuild(db)
+    finally:
+        db.close()
+
+
+async def resync_order_counter():
+    await run_db(rebuild_order_counter)
+
+
+# registered first, the producer sends its snapshot from the rebuilt counts.
+order_bus.add_resync(resync_order_counter)
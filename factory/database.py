@@ -1,26 +1,176 @@
-from sqlalchemy import create_engine
+import asyncio
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import Request, Response
+from sqlalchemy import create_engine, exc
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from factory.config import settings
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.db_username}:{settings.db_password}@{settings.db_hostname}:{settings.db_port}/{settings.db_name}"
+REPLICA_DATABASE_URL = f"postgresql://{settings.db_username}:{settings.db_password}@{settings.db_replica_hostname}:{settings.db_replica_port or settings.db_port}/{settings.db_name}"
+# set on the responses of writes, the client reads the primary until it expires.
+WRITE_COOKIE = "erg_wrote"
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits: deque[float] = deque(maxlen=1000)
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waits.append(time.perf_counter() - started)
+
+    def metrics(self, prefix: str = "db_pool") -> dict:
+        waits = list(self.waits)
+        return {
+            f"{prefix}_size": self.size(),
+            f"{prefix}_checked_out": self.checkedout(),
+            # connections open beyond the pool size, negative while the pool is not full yet.
+            f"{prefix}_overflow": self.overflow(),
+            f"{prefix}_wait_avg_ms": sum(waits) / len(waits) * 1000 if waits else 0,
+            f"{prefix}_wait_max_ms": max(waits, default=0) * 1000,
+            f"{prefix}_timeouts": self.timeouts,
+        }
 
 
 # for burmese language
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     encoding="utf-8",
+    poolclass=TimedQueuePool,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=settings.db_pool_pre_ping,
+    connect_args={
+        "options": f"-c statement_timeout={settings.db_statement_timeout_ms}"
+    },
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+replica_engine = None
+if settings.db_replica_hostname:
+    replica_engine = create_engine(
+        REPLICA_DATABASE_URL,
+        encoding="utf-8",
+        poolclass=TimedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={
+            "options": f"-c statement_timeout={settings.db_statement_timeout_ms}",
+            "connect_timeout": settings.db_replica_connect_timeout,
+        },
+    )
+
+
+class Replica:
+    """Tracks whether the read replica is up.
+
+    a replica that fails to connect is left alone for db_replica_retry_interval seconds,
+    the reads go to the primary meanwhile. a read that finds its pool full goes to the primary on its own.
+    """
+
+    def __init__(self):
+        self.down_until = 0.0
+        self.failovers = 0
+
+    def up(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def failed(self):
+        self.failovers += 1
+        self.down_until = time.monotonic() + settings.db_replica_retry_interval
+
+    def metrics(self) -> dict:
+        return {"db_replica_up": self.up(), "db_replica_failovers": self.failovers}
+
+
+replica = Replica()
+
 
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
+def read_only(request: Request):
+    """Lets get_db hand the route a session on the replica.
+
+    declared per endpoint or per router, dependencies=[Depends(read_only)].
+    """
+    request.state.read_only = True
+
+
+def reads_replica(request: Request, response: Response) -> bool:
+    if request.method != "GET":
+        # a write, the next reads of this client wait for the replica to catch up.
+        response.set_cookie(
+            WRITE_COOKIE,
+            "1",
+            max_age=settings.db_replica_read_after_write,
+            httponly=True,
+        )
+        return False
+    return (
+        getattr(request.state, "read_only", False)
+        and WRITE_COOKIE not in request.cookies
+        and replica.up()
+    )
+
+
+def replica_session() -> Session:
+    db = SessionLocal(bind=replica_engine)
+    try:
+        # checks out the connection now, a replica that is down fails here instead of in the route.
+        db.connection()
+    except exc.TimeoutError:
+        # every connection of the replica is busy, it is still up. db_replica_pool_timeouts counts these.
+        db.close()
+        return SessionLocal()
+    except exc.DBAPIError:
+        db.close()
+        replica.failed()
+        return SessionLocal()
+    return db
+
+
+def get_db(request: Request, response: Response):
+    if replica_engine is not None and reads_replica(request, response):
+        db = replica_session()
+    else:
+        db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+# async endpoints hand their session work to these threads instead of blocking the event loop.
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.db_thread_pool_size, thread_name_prefix="db"
+)
+
+
+async def run_db(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        db_executor, functools.partial(function, *args, **kwargs)
+    )
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from factory.config import settings
+from factory.database import SQLALCHEMY_DATABASE_URL, SessionLocal, run_db
+from factory.schema.stream_schema import OrderEvent
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENT_CHANNEL = "order_events"
+# sent through the broker instead of an event when events were lost, every worker resyncs.
+RESYNC_LINE = b"resync\n"
+# events waiting in session.info for the commit.
+PENDING_EVENTS = "pending_order_events"
+# the id of the writing transaction in session.info, one query per transaction.
+TRANSACTION_ID = "order_event_txid"
+
+
+def transaction_id(session: Session) -> int:
+    """the postgres id of the transaction of session, what tells an event from one already in a snapshot."""
+    if TRANSACTION_ID not in session.info:
+        session.info[TRANSACTION_ID] = session.execute(
+            select(func.txid_current())
+        ).scalar()
+    return session.info[TRANSACTION_ID]
+
+
+class InProcessBus:
+    """Delivers order events to the subscribers of this process after the session commits."""
+
+    def __init__(self):
+        self.subscribers: list[asyncio.Queue] = []
+        # called on the loop for every event, before the subscribers wake up.
+        self.handlers: list[Callable[[OrderEvent], None]] = []
+        # awaited in order when events may have been lost, each takes its state again from the database.
+        self.resyncs: list[Callable[[], Awaitable[None]]] = []
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        self.loop = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.remove(queue)
+
+    def add_handler(self, handler: Callable[[OrderEvent], None]):
+        self.handlers.append(handler)
+
+    def add_resync(self, resync: Callable[[], Awaitable[None]]):
+        self.resyncs.append(resync)
+
+    def remove_resync(self, resync: Callable[[], Awaitable[None]]):
+        self.resyncs.remove(resync)
+
+    async def resync(self):
+        for resync in list(self.resyncs):
+            await resync()
+
+    def publish(self, session: Session, order_event: OrderEvent):
+        session.info.setdefault(PENDING_EVENTS, []).append(order_event)
+
+    def dispatch(self, order_events: list[OrderEvent]):
+        # sync endpoints commit on the threadpool, so hand over to the loop.
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.deliver, order_events)
+
+    def deliver(self, order_events: list[OrderEvent]):
+        for handler in self.handlers:
+            for order_event in order_events:
+                handler(order_event)
+        for queue in self.subscribers:
+            for order_event in order_events:
+                queue.put_nowait(order_event)
+
+
+class PostgresBus(InProcessBus):
+    """NOTIFY inside the writing transaction and LISTEN on a dedicated connection.
+
+    postgres only sends the notification when the transaction commits, and sends it to every listening process.
+    a lost connection is opened again with backoff, the notifications sent meanwhile are gone so the
+    resyncs run once it listens again.
+    """
+
+    def __init__(self, dsn: str, retry_max: float = 30):
+        super().__init__()
+        self.dsn = dsn
+        self.retry_max = retry_max
+        self.connection = None
+        self.fileno: int | None = None
+        self.reconnecting: asyncio.Task | None = None
+
+    async def start(self):
+        await super().start()
+        await self.listen()
+
+    async def stop(self):
+        if self.reconnecting is not None:
+            self.reconnecting.cancel()
+            self.reconnecting = None
+        if self.connection is not None:
+            self.close()
+        await super().stop()
+
+    async def listen(self):
+        # connecting blocks, so it runs on the db threads.
+        connection = await run_db(psycopg2.connect, self.dsn)
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {ORDER_EVENT_CHANNEL};")
+        except psycopg2.Error:
+            connection.close()
+            raise
+        self.connection = connection
+        # kept, a connection postgres closed cannot tell its socket anymore.
+        self.fileno = connection.fileno()
+        self.loop.add_reader(self.fileno, self.receive)
+
+    def close(self):
+        self.loop.remove_reader(self.fileno)
+        self.connection.close()
+        self.connection = None
+
+    async def reconnect(self):
+        backoff = 1
+        while True:
+            try:
+                await self.listen()
+                break
+            except psycopg2.Error:
+                logger.warning("could not LISTEN again, retrying in %ss.", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.retry_max)
+        self.reconnecting = None
+        await self.resync()
+
+    def publish(self, session: Session, order_event: OrderEvent):
+        session.connection().execute(
+            select(func.pg_notify(ORDER_EVENT_CHANNEL, order_event.json()))
+        )
+
+    def dispatch(self, order_events: list[OrderEvent]):
+        # the notifications come back through LISTEN.
+        pass
+
+    def receive(self):
+        try:
+            self.connection.poll()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # a closed socket stays readable, the reader has to go before the loop spins on it.
+            logger.warning("lost the LISTEN connection of the order events.")
+            self.close()
+            self.reconnecting = asyncio.create_task(self.reconnect())
+            return
+        order_events = [
+            OrderEvent.parse_raw(notify.payload) for notify in self.connection.notifies
+        ]
+        self.connection.notifies.clear()
+        self.deliver(order_events)
+
+
+class UnixSocketBus(InProcessBus):
+    """Sends the committed events to the broker of factory.broker, which relays them to every worker.
+
+    a stand-in for LISTEN/NOTIFY when the workers share a machine. events committed while the broker is away
+    wait for it, up to unsent_size of them. a worker that comes back resyncs for the events it missed,
+    and when its own waiting events overflowed it has every worker resync.
+    """
+
+    def __init__(self, path: str, unsent_size: int = settings.event_unsent_size):
+        super().__init__()
+        self.path = path
+        self.writer: asyncio.StreamWriter | None = None
+        self.task: asyncio.Task | None = None
+        self.unsent: deque[bytes] = deque(maxlen=unsent_size)
+        self.overflowed = False
+
+    async def start(self):
+        await super().start()
+        self.task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        await super().stop()
+
+    async def listen(self):
+        # the counts of the first connection are taken at startup.
+        connected = False
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                self.flush(writer)
+                if connected:
+                    await self.resync()
+                connected = True
+                while line := await reader.readline():
+                    if line == RESYNC_LINE:
+                        await self.resync()
+                    else:
+                        self.deliver([OrderEvent.parse_raw(line)])
+            except OSError:
+                logger.warning("order event broker at %s is not reachable.", self.path)
+            self.writer = None
+            await asyncio.sleep(1)
+
+    def flush(self, writer: asyncio.StreamWriter):
+        while self.unsent:
+            writer.write(self.unsent.popleft())
+        if self.overflowed:
+            writer.write(RESYNC_LINE)
+            self.overflowed = False
+        self.writer = writer
+
+    def dispatch(self, order_events: list[OrderEvent]):
+        # the broker sends them back to this worker as well.
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.send, order_events)
+
+    def send(self, order_events: list[OrderEvent]):
+        lines = [order_event.json().encode() + b"\n" for order_event in order_events]
+        if self.writer is not None:
+            self.writer.writelines(lines)
+            return
+        if len(self.unsent) + len(lines) > self.unsent.maxlen:
+            # the oldest fall out, the workers resync once the broker is back.
+            logger.warning("dropped order events, no broker.")
+            self.overflowed = True
+        self.unsent.extend(lines)
+
+
+def create_bus() -> InProcessBus:
+    if settings.event_bus == "postgres":
+        return PostgresBus(SQLALCHEMY_DATABASE_URL)
+    if settings.event_bus == "unix":
+        return UnixSocketBus(settings.event_broker_path)
+    return InProcessBus()
+
+
+order_bus = create_bus()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def dispatch_order_events(session: Session):
+    session.info.pop(TRANSACTION_ID, None)
+    order_events = session.info.pop(PENDING_EVENTS, None)
+    if order_events:
+        order_bus.dispatch(order_events)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def discard_order_events(session: Session):
+    session.info.pop(TRANSACTION_ID, None)
+    session.info.pop(PENDING_EVENTS, None)
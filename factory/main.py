@@ -2,14 +2,30 @@ from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from factory import oauth2
+from factory.audit import audit_writer
+from factory.config import settings
+from factory.counters import rebuild_order_counter
+from factory.database import run_db
+from factory.events import order_bus
+from factory.monitor import loop_monitor
+from factory.pagination import NEXT_CURSOR_HEADER
 from factory.routers.auth import auth_router
-from factory.routers.c_channel.orders import cchannel_orders_router
 from factory.routers.customer import customer_router
-from factory.routers.ds.orders import ds_orders_router
-from factory.routers.roof.orders import roof_orders_router
+from factory.routers.stream.connection_manager import con_manager
+from factory.routers.stream.producer import order_count_producer
 from factory.routers.stream.stream import stream_router
 from factory.schema import token_schema
 
+# the same routes on asyncpg, only imported when asked for so asyncpg stays optional.
+if settings.db_async:
+    from factory.routers.c_channel.async_orders import cchannel_orders_router
+    from factory.routers.ds.async_orders import ds_orders_router
+    from factory.routers.roof.async_orders import roof_orders_router
+else:
+    from factory.routers.c_channel.orders import cchannel_orders_router
+    from factory.routers.ds.orders import ds_orders_router
+    from factory.routers.roof.orders import roof_orders_router
+
 app = FastAPI()
 
 # as we got alembic, we don't need this anymore
@@ -22,6 +38,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # the browser only lets the clients read the headers listed here.
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 
@@ -36,3 +54,26 @@ app.include_router(ds_orders_router)
 app.include_router(roof_orders_router)
 app.include_router(cchannel_orders_router)
 app.include_router(stream_router)
+
+
+@app.on_event("startup")
+async def start_order_stream():
+    await loop_monitor.start()
+    await audit_writer.start()
+    # listening first, the rebuild counts the events that come in meanwhile only when its snapshot missed them.
+    await order_bus.start()
+    await run_db(rebuild_order_counter)
+    await order_count_producer.start()
+
+
+@app.on_event("shutdown")
+async def stop_order_stream():
+    await order_count_producer.stop()
+    await con_manager.stop()
+    await order_bus.stop()
+    await audit_writer.stop()
+    await loop_monitor.stop()
+    if settings.db_async:
+        from factory.async_database import async_engine
+
+        await async_engine.dispose()
@@ -1,19 +1,34 @@
+import enum
 from datetime import datetime
+from operator import attrgetter
 
 from sqlalchemy import (
     FLOAT,
     TIMESTAMP,
     Column,
+    Date,
     Enum,
     ForeignKey,
+    Index,
     Integer,
+    MetaData,
+    Sequence,
     String,
+    Table,
     event,
+    inspect,
+    select,
+    text,
 )
-from sqlalchemy.orm import Mapper, Session, backref, relationship
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapper, ORMExecuteState, Session, backref, relationship
 
 from factory import utils
+from factory.audit import AuditRow, audit_writer
+from factory.config import settings
 from factory.database import Base, SessionLocal
+from factory.events import order_bus, transaction_id
+from factory.schema.stream_schema import OrderEvent
 
 
 class DSOrder(Base):
@@ -24,11 +39,13 @@ class DSOrder(Base):
         Integer,
         ForeignKey("customers.id", ondelete="SET NULL"),
         nullable=True,
+        index=True,
     )
     manager_id = Column(
         Integer,
         ForeignKey("managers.id"),
         nullable=True,
+        index=True,
     )
     created_at = Column(
         TIMESTAMP(timezone=True),
@@ -50,10 +67,22 @@ class DSOrder(Base):
 
 class DSOrderDetails(Base):
     __tablename__ = "ds_order_details"
+    # the not done orders by pick up time and order id, the keyset of the order lists.
+    __table_args__ = (
+        Index(
+            "ix_ds_order_details_not_done",
+            "pick_up_time",
+            "ds_order_id",
+            postgresql_where=text("production_stage <> 'done'"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, nullable=False)
     ds_order_id = Column(
-        Integer, ForeignKey("ds_orders.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("ds_orders.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     depth = Column(FLOAT(precision=1), nullable=False)
     length_per_sheet = Column(FLOAT(precision=2), nullable=False)
@@ -74,11 +103,13 @@ class CChannelOrder(Base):
         Integer,
         ForeignKey("customers.id", ondelete="SET NULL"),
         nullable=True,
+        index=True,
     )
     manager_id = Column(
         Integer,
         ForeignKey("managers.id"),
         nullable=True,
+        index=True,
     )
     created_at = Column(
         TIMESTAMP(timezone=True),
@@ -101,11 +132,21 @@ class CChannelOrder(Base):
 
 class CChannelOrderDetails(Base):
     __tablename__ = "cchannel_order_details"
+    # the not done orders by pick up time and order id, the keyset of the order lists.
+    __table_args__ = (
+        Index(
+            "ix_cchannel_order_details_not_done",
+            "pick_up_time",
+            "cchannel_order_id",
+            postgresql_where=text("production_stage <> 'done'"),
+        ),
+    )
     id = Column(Integer, primary_key=True, nullable=False)
     cchannel_order_id = Column(
         Integer,
         ForeignKey("cchannel_orders.id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
     )
     channel_height = Column(FLOAT(precision=2), nullable=False)
     channel_width = Column(FLOAT(precision=2), nullable=False)
@@ -128,11 +169,13 @@ class RoofOrder(Base):
         Integer,
         ForeignKey("customers.id", ondelete="SET NULL"),
         nullable=True,
+        index=True,
     )
     manager_id = Column(
         Integer,
         ForeignKey("managers.id"),
         nullable=True,
+        index=True,
     )
     created_at = Column(
         TIMESTAMP(timezone=True),
@@ -155,11 +198,21 @@ class RoofOrder(Base):
 
 class RoofOrderDetails(Base):
     __tablename__ = "roof_order_details"
+    # the not done orders by pick up time and order id, the keyset of the order lists.
+    __table_args__ = (
+        Index(
+            "ix_roof_order_details_not_done",
+            "pick_up_time",
+            "roof_order_id",
+            postgresql_where=text("production_stage <> 'done'"),
+        ),
+    )
     id = Column(Integer, primary_key=True, nullable=False)
     roof_order_id = Column(
         Integer,
         ForeignKey("roof_orders.id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
     )
     color = Column(String, nullable=False)
     manufacturer = Column(Enum(utils.ColorPlainManufacturer), nullable=False)
@@ -197,15 +250,87 @@ class Manager(Base):
 
 class Transcation(Base):
     __tablename__ = "transcations"
+    # the keyset of /stream/history.
+    __table_args__ = (Index("ix_transcations_modified_at_id", "modified_at", "id"),)
 
     id = Column(Integer, primary_key=True, nullable=False)
     product_type = Column(Enum(utils.Product), nullable=False)
     transcation_type = Column(Enum(utils.TransType), nullable=False)
     production_stage = Column(Enum(utils.ProductionStage), nullable=False)
+    # the stage before an update, empty for inserts and deletes.
+    previous_stage = Column(Enum(utils.ProductionStage), nullable=True)
+    # a callable, a plain datetime would stamp every row with the time the app started.
     modified_at = Column(
         TIMESTAMP(timezone=True),
         nullable=False,
-        default=datetime.now().astimezone(utils.LOCAL_TIME_ZONE),
+        default=lambda: datetime.now().astimezone(utils.LOCAL_TIME_ZONE),
+    )
+
+
+class OrderAudit(Base):
+    """one row per order insert or delete, the detail as it was kept in jsonb.
+
+    written instead of a transcation, an order log and a detail log when audit_format is "jsonb".
+    the ids come from the transcations sequence so /stream/check/{id} finds either kind.
+    partitioned by month on modified_at, which is why it is part of the key. see factory.audit_retention.
+    """
+
+    __tablename__ = "order_audits"
+    __table_args__ = (Index("ix_order_audits_modified_at_id", "modified_at", "id"),)
+
+    id = Column(Integer, Sequence("transcations_id_seq"), primary_key=True)
+    product_type = Column(Enum(utils.Product), nullable=False)
+    transcation_type = Column(Enum(utils.TransType), nullable=False)
+    production_stage = Column(Enum(utils.ProductionStage), nullable=False)
+    previous_stage = Column(Enum(utils.ProductionStage), nullable=True)
+    order_id = Column(Integer, nullable=True)
+    detail = Column(JSONB, nullable=False)
+    modified_at = Column(
+        TIMESTAMP(timezone=True),
+        primary_key=True,
+        default=lambda: datetime.now().astimezone(utils.LOCAL_TIME_ZONE),
+    )
+
+
+class OrderAuditDay(Base):
+    """order audits of one day counted per product, type and stage, what stays of a partition after retention."""
+
+    __tablename__ = "order_audit_days"
+
+    day = Column(Date, primary_key=True)
+    product_type = Column(Enum(utils.Product), primary_key=True)
+    transcation_type = Column(Enum(utils.TransType), primary_key=True)
+    production_stage = Column(Enum(utils.ProductionStage), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+
+class OrderBoardCheckpoint(Base):
+    """the board as it was at taken_at, factory.board replays order_history from here on."""
+
+    __tablename__ = "order_board_checkpoints"
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    taken_at = Column(TIMESTAMP(timezone=True), nullable=False, unique=True)
+    # [[product, stage, count], ...] of every order still there, done ones included.
+    counts = Column(JSONB, nullable=False)
+    # [[product, order id, stage], ...] of the orders not done yet.
+    orders = Column(JSONB, nullable=False)
+
+
+# a view over the transcations with their logs and over order_audits, created by the c5d2e8a1f4b3 migration.
+# it has a metadata of its own so create_all and autogenerate leave it alone.
+class OrderHistory(Base):
+    __table__ = Table(
+        "order_history",
+        MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("product_type", Enum(utils.Product)),
+        Column("transcation_type", Enum(utils.TransType)),
+        Column("production_stage", Enum(utils.ProductionStage)),
+        Column("previous_stage", Enum(utils.ProductionStage)),
+        Column("order_id", Integer),
+        Column("detail", JSONB),
+        Column("modified_at", TIMESTAMP(timezone=True)),
     )
 
 
@@ -216,6 +341,7 @@ class DSOrderLog(Base):
     transcation_id = Column(
         Integer,
         ForeignKey("transcations.id", ondelete="CASCADE"),
+        index=True,
     )
     ds_order_id = Column(Integer, nullable=True)
     transcations = relationship("Transcation", backref="ds_order_logs")
@@ -234,6 +360,7 @@ class DSOrderDetailsLog(Base):
     ds_order_logs_id = Column(
         Integer,
         ForeignKey("ds_order_logs.id", ondelete="CASCADE"),
+        index=True,
         nullable=False,
     )
     length_per_sheet = Column(FLOAT(precision=2), nullable=False)
@@ -252,6 +379,7 @@ class CChannelOrderLog(Base):
     transcation_id = Column(
         Integer,
         ForeignKey("transcations.id", ondelete="CASCADE"),
+        index=True,
     )
     cchannel_order_id = Column(Integer, nullable=True)
     transcations = relationship("Transcation", backref="cchannel_order_logs")
@@ -269,6 +397,7 @@ class CChannelOrderDetailLog(Base):
     cchannel_order_logs_id = Column(
         Integer,
         ForeignKey("cchannel_order_logs.id", ondelete="CASCADE"),
+        index=True,
         nullable=False,
     )
     channel_height = Column(FLOAT(precision=2), nullable=False)
@@ -290,6 +419,7 @@ class RoofOrderLog(Base):
     transcation_id = Column(
         Integer,
         ForeignKey("transcations.id", ondelete="CASCADE"),
+        index=True,
     )
     roof_order_id = Column(Integer, nullable=True)
     transcations = relationship("Transcation", backref="roof_order_logs")
@@ -307,6 +437,7 @@ class RoofOrderDetailLogs(Base):
     roof_order_logs_id = Column(
         Integer,
         ForeignKey("roof_order_logs.id", ondelete="CASCADE"),
+        index=True,
         nullable=False,
     )
     color = Column(String, nullable=False)
@@ -340,235 +471,275 @@ class CustomerLog(Base):
     transcation_type = Column(Enum(utils.TransType), nullable=False)
 
 
-# this will work only with session.delete(obj) Not with query.delete()
-@event.listens_for(Customer, "after_insert")
-def receive_after_insert(mapper: Mapper, connection, target: Customer):
-    new_trans_logs = CustomerLog(
-        name=target.name,
-        phone=target.phone,
-        address=target.address,
-        gender=target.gender,
-        customer_id=target.id,
-        transcation_type=utils.TransType.insert,
-    )
-    db: Session = SessionLocal()
-    db.add(new_trans_logs)
-    db.commit()
-    db.close()
+class AuditPlan:
+    """how a model is copied into its log, worked out once at import.
+
+    the columns the log shares with the model are read with one attrgetter call per event.
+    """
+
+    def __init__(self, log: type, model: type, **renamed: str):
+        # log column=model attribute for the ones named differently, like customer_id="id".
+        attributes = inspect(model).column_attrs.keys()
+        self.log = log
+        self.keys = tuple(
+            column.key
+            for column in log.__table__.columns
+            if not column.primary_key
+            and column.key in attributes
+            and column.key not in renamed
+        ) + tuple(renamed)
+        read = attrgetter(*[renamed.get(key, key) for key in self.keys])
+        # with a single name attrgetter gives the value itself, not a tuple.
+        self.read = read if len(self.keys) > 1 else lambda target: (read(target),)
+
+    def values(self, target) -> dict:
+        return dict(zip(self.keys, self.read(target)))
+
+
+def detail_snapshot(values: dict) -> dict:
+    # enums by name and times in iso format, the way postgres turns the old detail log rows into jsonb.
+    return {
+        key: value.name
+        if isinstance(value, enum.Enum)
+        else value.isoformat()
+        if isinstance(value, datetime)
+        else value
+        for key, value in values.items()
+        if value is not None
+    }
+
+
+class OrderAuditPlan:
+    """the logs of an order change: a transcation, an order log and a detail log, or one OrderAudit row."""
+
+    def __init__(
+        self,
+        product: utils.Product,
+        order: type,
+        detail: str,
+        order_log: type,
+        order_key: str,
+        detail_log: type,
+        detail_key: str,
+    ):
+        self.product = product
+        self.order = order
+        relationship = inspect(order).relationships[detail]
+        self.details = relationship.mapper.class_
+        # the id of the order and the column of the detail that points at it.
+        ((self.order_id, self.detail_order_id),) = relationship.local_remote_pairs
+        self.detail = attrgetter(detail)
+        self.order_log = order_log
+        self.order_key = order_key
+        self.detail_key = detail_key
+        self.copy = AuditPlan(detail_log, self.details)
+
+    def log(
+        self,
+        session: Session,
+        order_id: int,
+        transcation_type: utils.TransType,
+        production_stage: utils.ProductionStage,
+        detail,
+        previous_stage: utils.ProductionStage | None = None,
+    ):
+        """writes the logs of a change of the detail, an object or a returned row."""
+        transcation = {
+            "product_type": self.product,
+            "transcation_type": transcation_type,
+            "production_stage": production_stage,
+            "previous_stage": previous_stage,
+            # stamped now, a buffered writer inserts it later.
+            "modified_at": datetime.now().astimezone(utils.LOCAL_TIME_ZONE),
+        }
+        detail_values = self.copy.values(detail)
+        if settings.audit_format == "jsonb":
+            record = [
+                AuditRow(
+                    OrderAudit,
+                    {
+                        **transcation,
+                        "order_id": order_id,
+                        "detail": detail_snapshot(detail_values),
+                    },
+                )
+            ]
+        else:
+            record = [
+                AuditRow(Transcation, transcation),
+                AuditRow(self.order_log, {self.order_key: order_id}, "transcation_id"),
+                AuditRow(self.copy.log, detail_values, self.detail_key),
+            ]
+        audit_writer.write(session, record)
+
+    def record(
+        self,
+        session: Session,
+        order_id: int,
+        customer_id: int | None,
+        transcation_type: utils.TransType,
+        production_stage: utils.ProductionStage,
+        detail,
+        previous_stage: utils.ProductionStage | None = None,
+    ):
+        """logs a change of the detail and publishes it."""
+        self.log(
+            session,
+            order_id,
+            transcation_type,
+            production_stage,
+            detail,
+            previous_stage,
+        )
+        order_bus.publish(
+            session,
+            OrderEvent(
+                product_type=self.product,
+                transcation_type=transcation_type,
+                production_stage=production_stage,
+                previous_stage=previous_stage,
+                order_id=order_id,
+                customer_id=customer_id,
+                txid=transaction_id(session),
+            ),
+        )
+
+
+# every audited order. an order of a new product, like Product.c_purlin, needs its four tables and a line here.
+ORDER_AUDITS = {
+    plan.order: plan
+    for plan in (
+        OrderAuditPlan(
+            utils.Product.ds,
+            DSOrder,
+            "ds_order_detail",
+            DSOrderLog,
+            "ds_order_id",
+            DSOrderDetailsLog,
+            "ds_order_logs_id",
+        ),
+        OrderAuditPlan(
+            utils.Product.c_channel,
+            CChannelOrder,
+            "cchannel_order_detail",
+            CChannelOrderLog,
+            "cchannel_order_id",
+            CChannelOrderDetailLog,
+            "cchannel_order_logs_id",
+        ),
+        OrderAuditPlan(
+            utils.Product.roof,
+            RoofOrder,
+            "roof_order_detail",
+            RoofOrderLog,
+            "roof_order_id",
+            RoofOrderDetailLogs,
+            "roof_order_logs_id",
+        ),
+    )
+}
+# the other audited models, logged in one row with the type of the change.
+LOG_AUDITS = {
+    Customer: AuditPlan(CustomerLog, Customer, customer_id="id"),
+    Manager: AuditPlan(ManagerLog, Manager, manager_id="id"),
+}
+# the live detail table of every product that has one.
+ORDER_DETAILS = {plan.product: plan.details for plan in ORDER_AUDITS.values()}
+DETAIL_AUDITS = {plan.details: plan for plan in ORDER_AUDITS.values()}
+
+
+def audit(mapper: Mapper, target, transcation_type: utils.TransType):
+    session = Session.object_session(target)
+    plan = ORDER_AUDITS.get(mapper.class_)
+    if plan is None:
+        log = LOG_AUDITS[mapper.class_]
+        audit_writer.write(
+            session,
+            [
+                AuditRow(
+                    log.log,
+                    {**log.values(target), "transcation_type": transcation_type},
+                )
+            ],
+        )
+        return
+    detail = plan.detail(target)
+    plan.record(
+        session,
+        target.id,
+        target.customer_id,
+        transcation_type,
+        detail.production_stage,
+        detail,
+    )
 
 
 # this will work only with session.delete(obj) Not with query.delete()
-@event.listens_for(Customer, "before_delete")
-def receive_before_delete(mapper: Mapper, connection, target: Customer):
-    new_trans_logs = CustomerLog(
-        name=target.name,
-        phone=target.phone,
-        address=target.address,
-        gender=target.gender,
-        customer_id=target.id,
-        transcation_type=utils.TransType.delete,
-    )
-
-    db: Session = SessionLocal()
-    db.add(new_trans_logs)
-    db.commit()
-    db.close()
-
-
-@event.listens_for(Manager, "after_insert")
-def receive_after_insert(mapper: Mapper, connection, target: Manager):
-    new_trans_logs = ManagerLog(
-        name=target.name,
-        type=target.type,
-        manager_id=target.id,
-        transcation_type=utils.TransType.insert,
-    )
-    db: Session = SessionLocal()
-    db.add(new_trans_logs)
-    db.commit()
-    db.close()
-
-
-@event.listens_for(Manager, "before_delete")
-def receive_before_delete(mapper: Mapper, connection, target: Manager):
-    new_trans_logs = ManagerLog(
-        name=target.name,
-        type=target.type,
-        manager_id=target.id,
-        transcation_type=utils.TransType.delete,
-    )
-    db: Session = SessionLocal()
-    db.add(new_trans_logs)
-    db.commit()
-    db.close()
-
-
-@event.listens_for(DSOrder, "after_insert")
-def receive_after_insert(mapper: Mapper, connection, target: DSOrder):
-
-    new_detail_log: DSOrderDetails = target.ds_order_detail
-
-    new_order_log = DSOrderLog(ds_order_id=target.id)
-    new_order_log.ds_order_detail_logs = DSOrderDetailsLog(
-        length_per_sheet=new_detail_log.length_per_sheet,
-        total_length=new_detail_log.total_length,
-        no_of_sheets=new_detail_log.no_of_sheets,
-        depth=new_detail_log.depth,
-        thickness=new_detail_log.thickness,
-        zinc_grade=new_detail_log.zinc_grade,
-        pick_up_time=new_detail_log.pick_up_time,
-        notes=new_detail_log.notes,
-    )
-    new_order_log.transcations = Transcation(
-        product_type=utils.Product.ds,
-        transcation_type=utils.TransType.insert,
-        production_stage=new_detail_log.production_stage,
-    )
-    db: Session = SessionLocal()
-    db.add(new_order_log)
-    db.commit()
-    db.close()
-
-
-@event.listens_for(DSOrder, "before_delete")
-def receive_before_delete(mapper: Mapper, connection, target: DSOrder):
-    new_detail_log: DSOrderDetails = target.ds_order_detail
-    new_order_log = DSOrderLog(ds_order_id=target.id)
-    new_order_log.ds_order_detail_logs = DSOrderDetailsLog(
-        length_per_sheet=new_detail_log.length_per_sheet,
-        total_length=new_detail_log.total_length,
-        no_of_sheets=new_detail_log.no_of_sheets,
-        depth=new_detail_log.depth,
-        thickness=new_detail_log.thickness,
-        zinc_grade=new_detail_log.zinc_grade,
-        pick_up_time=new_detail_log.pick_up_time,
-        notes=new_detail_log.notes,
-    )
-    new_order_log.transcations = Transcation(
-        product_type=utils.Product.ds,
-        transcation_type=utils.TransType.delete,
-        production_stage=new_detail_log.production_stage,
-    )
-    db: Session = SessionLocal()
-    db.add(new_order_log)
-    db.commit()
-    db.close()
-
-
-@event.listens_for(CChannelOrder, "after_insert")
-def receive_after_insert(mapper: Mapper, connection, target: CChannelOrder):
-    new_detail_log: CChannelOrderDetails = target.cchannel_order_detail
-    new_order_log = CChannelOrderLog(
-        cchannel_order_id=target.id,
-    )
-    new_order_log.cchannel_order_detail_logs = CChannelOrderDetailLog(
-        channel_height=new_detail_log.channel_height,
-        channel_width=new_detail_log.channel_width,
-        holes=new_detail_log.holes,
-        length_per_sheet=new_detail_log.length_per_sheet,
-        no_of_sheets=new_detail_log.no_of_sheets,
-        total_length=new_detail_log.total_length,
-        thickness=new_detail_log.thickness,
-        zinc_grade=new_detail_log.zinc_grade,
-        pick_up_time=new_detail_log.pick_up_time,
-        notes=new_detail_log.notes,
-    )
-    new_order_log.transcations = Transcation(
-        product_type=utils.Product.c_channel,
-        transcation_type=utils.TransType.insert,
-        production_stage=new_detail_log.production_stage,
-    )
-    db: Session = SessionLocal()
-    db.add(new_order_log)
-    db.commit()
-    db.close()
-
-
-@event.listens_for(CChannelOrder, "before_delete")
-def receive_before_delete(mapper: Mapper, connection, target: CChannelOrder):
-    new_detail_log: CChannelOrderDetails = target.cchannel_order_detail
-    new_order_log = CChannelOrderLog(
-        cchannel_order_id=target.id,
-    )
-    new_order_log.cchannel_order_detail_logs = CChannelOrderDetailLog(
-        channel_height=new_detail_log.channel_height,
-        channel_width=new_detail_log.channel_width,
-        holes=new_detail_log.holes,
-        length_per_sheet=new_detail_log.length_per_sheet,
-        total_length=new_detail_log.total_length,
-        no_of_sheets=new_detail_log.no_of_sheets,
-        thickness=new_detail_log.thickness,
-        zinc_grade=new_detail_log.zinc_grade,
-        pick_up_time=new_detail_log.pick_up_time,
-        notes=new_detail_log.notes,
-    )
-    new_order_log.transcations = Transcation(
-        product_type=utils.Product.c_channel,
-        transcation_type=utils.TransType.delete,
-        production_stage=new_detail_log.production_stage,
-    )
-    db: Session = SessionLocal()
-    db.add(new_order_log)
-    db.commit()
-    db.close()
-
-
-@event.listens_for(RoofOrder, "after_insert")
-def receive_after_insert(mapper: Mapper, connection, target: RoofOrder):
-    new_detail_log: RoofOrderDetails = target.roof_order_detail
-    new_order_log = RoofOrderLog(
-        roof_order_id=target.id,
-    )
-    new_order_log.roof_order_detail_logs = RoofOrderDetailLogs(
-        color=new_detail_log.color,
-        manufacturer=new_detail_log.manufacturer,
-        length_per_sheet=new_detail_log.length_per_sheet,
-        no_of_sheets=new_detail_log.no_of_sheets,
-        total_length=new_detail_log.total_length,
-        thickness=new_detail_log.thickness,
-        pick_up_time=new_detail_log.pick_up_time,
-        notes=new_detail_log.notes,
-    )
-    new_order_log.transcations = Transcation(
-        product_type=utils.Product.roof,
-        transcation_type=utils.TransType.insert,
-        production_stage=new_detail_log.production_stage,
-    )
-    db: Session = SessionLocal()
-    db.add(new_order_log)
-    db.commit()
-    db.close()
-
-
-@event.listens_for(RoofOrder, "before_delete")
-def receive_before_delete(mapper: Mapper, connection, target: RoofOrder):
-    new_detail_log: RoofOrderDetails = target.roof_order_detail
-    new_order_log = RoofOrderLog(
-        roof_order_id=target.id,
-    )
-    new_order_log.roof_order_detail_logs = RoofOrderDetailLogs(
-        color=new_detail_log.color,
-        manufacturer=new_detail_log.manufacturer,
-        length_per_sheet=new_detail_log.length_per_sheet,
-        total_length=new_detail_log.total_length,
-        no_of_sheets=new_detail_log.no_of_sheets,
-        thickness=new_detail_log.thickness,
-        pick_up_time=new_detail_log.pick_up_time,
-        notes=new_detail_log.notes,
-    )
-    new_order_log.transcations = Transcation(
-        production_stage=new_detail_log.production_stage,
-        product_type=utils.Product.roof,
-        transcation_type=utils.TransType.delete,
-    )
-    db: Session = SessionLocal()
-    db.add(new_order_log)
-    db.commit()
-    db.close()
-
-
-# this will work only with query.update(). Not with session.update(obj)
-# @event.listens_for(SessionLocal, "after_bulk_update")
-# def receive_after_bulk_update(update_context):
-#     print(f"mapper is {update_context.mapper.class_}")
-#     print(f"updated the values are {update_context.values}")
+def receive_after_insert(mapper: Mapper, connection, target):
+    audit(mapper, target, utils.TransType.insert)
+
+
+def receive_before_delete(mapper: Mapper, connection, target):
+    audit(mapper, target, utils.TransType.delete)
+
+
+for audited in (*ORDER_AUDITS, *LOG_AUDITS):
+    event.listen(audited, "after_insert", receive_after_insert)
+    event.listen(audited, "before_delete", receive_before_delete)
+
+
+# query.update() skips the mapper listeners, so the updates of the detail tables are caught here.
+@event.listens_for(SessionLocal, "do_orm_execute")
+def receive_do_orm_execute(orm_execute_state: ORMExecuteState):
+    """logs the stage changes of an update without loading the details into the session.
+
+    the update gets a locked cte with the stages before it and the order joined for its customer,
+    and returns the changed rows, so a bulk stage change is still one round trip.
+    """
+    if not orm_execute_state.is_update or orm_execute_state.bind_mapper is None:
+        return
+    mapper = orm_execute_state.bind_mapper
+    plan = DETAIL_AUDITS.get(mapper.class_)
+    if plan is None:
+        return
+    statement = orm_execute_state.statement
+    details = mapper.local_table
+    previous = select(
+        details.c.id, details.c.production_stage.label("previous_stage")
+    ).with_for_update()
+    if statement.whereclause is not None:
+        previous = previous.where(statement.whereclause)
+    previous = previous.cte("previous")
+    session = orm_execute_state.session
+    result = session.connection().execute(
+        statement.where(
+            details.c.id == previous.c.id,
+            plan.order_id == plan.detail_order_id,
+        ).returning(
+            *details.c,
+            previous.c.previous_stage,
+            plan.order_id.table.c.customer_id,
+        )
+    )
+    # the rows are read here, the caller gets them again from a copy, with the rowcount it checks.
+    rows = result.freeze()
+    for row in rows().all():
+        # nothing synchronizes the session with the update, so a detail it holds is read again.
+        detail = session.identity_map.get(
+            mapper.identity_key_from_primary_key([row.id])
+        )
+        if detail is not None:
+            session.expire(detail)
+        if row.production_stage != row.previous_stage:
+            plan.record(
+                session,
+                row._mapping[plan.detail_order_id.key],
+                row.customer_id,
+                utils.TransType.update,
+                row.production_stage,
+                row,
+                previous_stage=row.previous_stage,
+            )
+    updated = rows()
+    updated.rowcount = result.rowcount
+    return updated
@@ -0,0 +1,39 @@
+import asyncio
+import time
+from collections import deque
+
+
+class LoopLagMonitor:
+    """Wakes up every interval and records how late it was.
+
+    the lateness is how long something, like a sync query, held the event loop.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lags: deque[float] = deque(maxlen=600)
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - started - self.interval)
+
+    def metrics(self) -> dict:
+        lags = list(self.lags)
+        return {
+            "loop_lag_avg_ms": sum(lags) / len(lags) * 1000 if lags else 0,
+            "loop_lag_max_ms": max(lags, default=0) * 1000,
+        }
+
+
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,43 @@
+"""Moves the three table order logs into order_audits, a batch per transaction.
+
+the order_history view reads the same before and after, the old tables shrink so vacuum has less to do.
+run it once audit_format is "jsonb": python -m factory.move_audits [batch size]
+"""
+import sys
+
+from sqlalchemy import text
+
+from factory.database import engine
+
+MOVE_BATCH = text(
+    """
+    WITH batch AS (
+        SELECT id FROM transcations ORDER BY id LIMIT :batch_size FOR UPDATE SKIP LOCKED
+    ), moved AS (
+        INSERT INTO order_audits
+            (id, product_type, transcation_type, production_stage, previous_stage,
+             order_id, detail, modified_at)
+        SELECT h.id, h.product_type, h.transcation_type, h.production_stage, h.previous_stage,
+               h.order_id, coalesce(h.detail, '{}'), h.modified_at
+        FROM order_history h JOIN batch USING (id)
+        RETURNING id
+    )
+    -- the order logs and their detail logs go with it, on delete cascade.
+    DELETE FROM transcations WHERE id IN (SELECT id FROM moved)
+    """
+)
+
+
+def move_audits(batch_size: int = 1000) -> int:
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            count = connection.execute(MOVE_BATCH, {"batch_size": batch_size}).rowcount
+        if not count:
+            return moved
+        moved += count
+        print(f"moved {moved} order logs.")
+
+
+if __name__ == "__main__":
+    move_audits(*map(int, sys.argv[1:]))
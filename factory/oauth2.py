@@ -82,7 +82,7 @@ def renew_token(_token: str):
     )
 
 
-def get_manager(
+async def get_manager(
     _token: str = Depends(oauth2_scheme),
 ) -> None | token_schema.PayloadData:
     credential_exceptions = HTTPException(
@@ -93,7 +93,7 @@ def get_manager(
     return verify_access_token(_token, credential_exceptions)
 
 
-def get_admin(
+async def get_admin(
     current_token: token_schema.PayloadData = Depends(get_manager),
 ) -> None | token_schema.PayloadData:
     if not ManagerType.is_admin(current_token.manager_type):
@@ -103,7 +103,7 @@ def get_admin(
     return current_token
 
 
-def get_issuer(
+async def get_issuer(
     current_token: token_schema.PayloadData = Depends(get_manager),
 ) -> None | token_schema.PayloadData:
     if not ManagerType.is_issuer(current_token.manager_type):
@@ -113,7 +113,7 @@ def get_issuer(
     return current_token
 
 
-def get_listener(
+async def get_listener(
     current_token: token_schema.PayloadData = Depends(get_manager),
 ) -> None | token_schema.PayloadData:
     if not ManagerType.is_listener(current_token.manager_type):
@@ -0,0 +1,68 @@
+from fastapi import HTTPException, Request, Response, status
+from sqlalchemy import tuple_
+
+from factory import utils
+from factory.config import settings
+
+# the cursor of the next page, the body of the order lists stays a list of orders.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def search_filters(request: Request) -> dict:
+    """the query params of a search that are customer columns, without the ones of the page."""
+    return {
+        key: value
+        for key, value in request.query_params._dict.items()
+        if key not in ("cursor", "limit")
+    }
+
+
+class OrderPage:
+    """A keyset page of an order list, by the pick up time of the orders and then their id.
+
+    the next page starts after the last order of this one, an order added or done in between
+    does not shift the pages like an offset would.
+    """
+
+    def __init__(
+        self,
+        detail,
+        cursor: str | None,
+        limit: int,
+        descending: bool = False,
+    ):
+        # detail is the relationship of the order to its detail, like models.DSOrder.ds_order_detail.
+        details = detail.property.mapper.class_
+        self.detail = detail.key
+        # the id of the order on the detail row, the whole keyset is on one table.
+        ((_, order_id),) = detail.property.local_remote_pairs
+        self.keys = (details.pick_up_time, order_id)
+        self.limit = min(limit, settings.orders_max_page_size)
+        self.descending = descending
+        try:
+            self.after = utils.decode_cursor(cursor) if cursor else None
+        except ValueError as error:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(error)
+            )
+
+    def query(self, query):
+        """the orders of the page and the first of the next one, for a Query or a select."""
+        if self.after:
+            key = tuple_(*self.keys)
+            query = query.filter(
+                key < self.after if self.descending else key > self.after
+            )
+        return query.order_by(
+            *(key.desc() if self.descending else key.asc() for key in self.keys)
+        ).limit(self.limit + 1)
+
+    def orders(self, orders: list, response: Response) -> list:
+        """the orders of the page, the cursor of the next page goes in the header when there is one."""
+        if len(orders) > self.limit:
+            orders = orders[: self.limit]
+            last = orders[-1]
+            response.headers[NEXT_CURSOR_HEADER] = utils.encode_cursor(
+                getattr(last, self.detail).pick_up_time, last.id
+            )
+        return orders
@@ -0,0 +1,252 @@
+from datetime import datetime
+
+from factory import models, oauth2
+from factory.async_database import get_db
+from factory.config import settings
+from factory.database import read_only
+from factory.pagination import OrderPage, search_filters
+from factory.routers.c_channel.holes_utils import saving_holes_image
+from factory.schema import c_channel_schema, orders_update_schema, token_schema
+from factory.utils import BasePath, ProductionStage
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    status,
+)
+from fastapi.responses import FileResponse
+from sqlalchemy import exc, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, selectinload
+
+# the routes of factory.routers.c_channel.orders on an AsyncSession, mounted instead of them when db_async is on.
+cchannel_orders_router = APIRouter(
+    prefix="/cchannel",
+    tags=["C Channel"],
+)
+
+
+def not_done_orders():
+    # everything CChannelOrderOut reads is loaded here, an async session cannot load it lazily later.
+    return (
+        select(models.CChannelOrder)
+        .join(models.CChannelOrderDetails)
+        .options(
+            contains_eager(models.CChannelOrder.cchannel_order_detail),
+            selectinload(models.CChannelOrder.cchannel_customer),
+            selectinload(models.CChannelOrder.cchannel_manager),
+        )
+        .filter(models.CChannelOrderDetails.production_stage != ProductionStage.done)
+    )
+
+
+@cchannel_orders_router.get(
+    "/orders/all",
+    description="The data is sorted by pick_up_time by default. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
+    response_model=list[c_channel_schema.CChannelOrderOut],
+    dependencies=[Depends(read_only)],
+)
+async def get_all_orders(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    page = OrderPage(models.CChannelOrder.cchannel_order_detail, cursor, limit)
+    results = await db.execute(page.query(not_done_orders()))
+    return page.orders(results.scalars().all(), response)
+
+
+@cchannel_orders_router.put("/orders/details/update/{id}")
+async def update_an_order(
+    id: int,
+    order: orders_update_schema.OrderDetailUpdate,
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    # models.receive_do_orm_execute logs and publishes the stage change, like for the sync routes.
+    result = await db.execute(
+        update(models.CChannelOrderDetails)
+        .where(models.CChannelOrderDetails.id == id)
+        .values(order.dict())
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Connect to the Admin.",
+        )
+    await db.commit()
+    return
+
+
+@cchannel_orders_router.get(
+    "/orders/search/customer_info",
+    description="Search orders by customer info. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
+    response_model=list[c_channel_schema.CChannelOrderOut],
+    dependencies=[Depends(read_only)],
+)
+async def search_order(
+    request: Request,
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    page = OrderPage(models.CChannelOrder.cchannel_order_detail, cursor, limit)
+    try:
+        query_params = search_filters(request)
+        results_query = page.query(
+            not_done_orders().join(models.Customer).filter_by(**query_params)
+        )
+    except exc.InvalidRequestError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invaild Search Query. Check the parameters again.",
+        )
+    results = await db.execute(results_query)
+    return page.orders(results.scalars().all(), response)
+
+
+@cchannel_orders_router.get(
+    "/get/image/{id}",
+    description="accept order detail id and give back image",
+)
+async def get_images(
+    id: int,
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    query = await db.get(models.CChannelOrderDetails, id)
+    if query is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Can't find image associated to this order.",
+        )
+
+    return FileResponse(query.holes)
+
+
+@cchannel_orders_router.delete(
+    "/orders/delete/{id}",
+    description="delete the existing order",
+    status_code=status.HTTP_204_NO_CONTENT,
+    # an empty body, and the headers get_db set on the response, like the read after write cookie.
+    response_class=Response,
+)
+async def delete_an_order(
+    id: int,
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_issuer),
+):
+    order_to_delete: models.CChannelOrder = await db.get(
+        models.CChannelOrder,
+        id,
+        options=[selectinload(models.CChannelOrder.cchannel_order_detail)],
+    )
+    if order_to_delete is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The order does not exist.",
+        )
+    # use this method to catch order object to be deleted in event listener (before_delete).
+    if (
+        order_to_delete.cchannel_order_detail.production_stage
+        == ProductionStage.pending
+    ):
+        await db.delete(order_to_delete)
+        await db.commit()
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="The order is either done or producing and it cannot be stopped.",
+        )
+    return
+
+
+async def save_order(
+    db: AsyncSession, order: c_channel_schema.CChannelOrderCreate
+) -> int:
+    # TODO: replace manager_id.
+    new_order = models.CChannelOrder(manager_id=1, customer_id=order.customer_id)
+    new_order.cchannel_order_detail = models.CChannelOrderDetails(
+        **order.cchannel_order_detail.dict()
+    )
+    db.add(new_order)
+    # the session does not expire on commit, the id is still there.
+    await db.commit()
+    return new_order.id
+
+
+async def save_holes_path(db: AsyncSession, order_id: int, holes_path: str):
+    await db.execute(
+        update(models.CChannelOrderDetails)
+        .where(models.CChannelOrderDetails.cchannel_order_id == order_id)
+        .values({models.CChannelOrderDetails.holes: holes_path})
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+@cchannel_orders_router.post("/create")
+async def create_order(
+    # Warning: The File parameter on the POST method must go first, before other Form parameters. Otherwise the end-point returns HTTP code 422.
+    background_task: BackgroundTasks,
+    file: UploadFile | None = File(None),
+    customer_id: int = Form(...),
+    channel_height: float = Form(...),
+    channel_width: float = Form(...),
+    length_per_sheet: float = Form(...),
+    no_of_sheets: int = Form(...),
+    thickness: float = Form(...),
+    zinc_grade: int = Form(...),
+    pick_up_time: datetime = Form(...),
+    notes: str | None = Form(None),
+    production_stage: ProductionStage | None = Form(...),
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_issuer),
+):
+
+    try:
+        order_detail_scheme = c_channel_schema.CChannelOrderDetailCreate(
+            channel_height=channel_height,
+            channel_width=channel_width,
+            production_stage=production_stage,
+            length_per_sheet=length_per_sheet,
+            no_of_sheets=no_of_sheets,
+            thickness=thickness,
+            zinc_grade=zinc_grade,
+            pick_up_time=pick_up_time,
+            notes=notes,
+        )
+        pydantic_scheme = c_channel_schema.CChannelOrderCreate(
+            customer_id=customer_id,
+            cchannel_order_detail=order_detail_scheme,
+        )
+        new_order_id = await save_order(db, pydantic_scheme)
+        if file:
+            file_type = file.content_type.split("/")
+            if "image" not in file_type:
+                raise HTTPException(
+                    status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                    detail="Unsupported file type.",
+                )
+            holes_path = BasePath.joinpath(f"{new_order_id}.{file_type[1]}")
+            background_task.add_task(
+                saving_holes_image,
+                file,
+                holes_path,
+            )
+            await save_holes_path(db, new_order_id, str(holes_path))
+
+    except HTTPException as e:
+        raise e
@@ -1,7 +1,9 @@
 from datetime import datetime
 
 from factory import models, oauth2
-from factory.database import get_db
+from factory.config import settings
+from factory.database import get_db, read_only, run_db
+from factory.pagination import OrderPage, search_filters
 from factory.routers.c_channel.holes_utils import saving_holes_image
 from factory.schema import c_channel_schema, orders_update_schema, token_schema
 from factory.utils import BasePath, ProductionStage
@@ -12,6 +14,7 @@ from fastapi import (
     File,
     Form,
     HTTPException,
+    Query,
     Request,
     Response,
     UploadFile,
@@ -19,7 +22,7 @@ from fastapi import (
 )
 from fastapi.responses import FileResponse
 from sqlalchemy import exc
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager, selectinload
 
 cchannel_orders_router = APIRouter(
     prefix="/cchannel",
@@ -27,23 +30,36 @@ cchannel_orders_router = APIRouter(
 )
 
 
+def not_done_orders(db: Session):
+    # everything CChannelOrderOut reads comes in three queries, whatever the number of orders.
+    # the detail is joined for the filter anyway, the few customers and managers are loaded by id.
+    return (
+        db.query(models.CChannelOrder)
+        .join(models.CChannelOrderDetails)
+        .options(
+            contains_eager(models.CChannelOrder.cchannel_order_detail),
+            selectinload(models.CChannelOrder.cchannel_customer),
+            selectinload(models.CChannelOrder.cchannel_manager),
+        )
+        .filter(models.CChannelOrderDetails.production_stage != ProductionStage.done)
+    )
+
+
 @cchannel_orders_router.get(
     "/orders/all",
-    description="The data is sorted by pick_up_time by default.",
+    description="The data is sorted by pick_up_time by default. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
     response_model=list[c_channel_schema.CChannelOrderOut],
+    dependencies=[Depends(read_only)],
 )
 def get_all_orders(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
     db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
-    results = (
-        db.query(models.CChannelOrder)
-        .join(models.CChannelOrderDetails)
-        .order_by(models.CChannelOrderDetails.pick_up_time.asc())
-        .filter(models.CChannelOrderDetails.production_stage != ProductionStage.done)
-    ).all()
-
-    return results
+    page = OrderPage(models.CChannelOrder.cchannel_order_detail, cursor, limit)
+    return page.orders(page.query(not_done_orders(db)).all(), response)
 
 
 @cchannel_orders_router.put("/orders/details/update/{id}")
@@ -56,40 +72,38 @@ def update_an_order(
     order_query = db.query(models.CChannelOrderDetails).filter(
         models.CChannelOrderDetails.id == id
     )
-    if order_query.first() is None:
+    # the rows are not loaded first, models.receive_do_orm_execute logs and publishes the stage change.
+    if not order_query.update(order.dict(), synchronize_session=False):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Connect to the Admin.",
         )
-    order_query.update(order.dict(), synchronize_session=False)
     db.commit()
     return
 
 
 @cchannel_orders_router.get(
     "/orders/search/customer_info",
-    description="Search orders by customer info.",
+    description="Search orders by customer info. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
     response_model=list[c_channel_schema.CChannelOrderOut],
+    dependencies=[Depends(read_only)],
 )
 def search_order(
     request: Request,
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
     db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
+    page = OrderPage(models.CChannelOrder.cchannel_order_detail, cursor, limit)
     try:
-        query_params = request.query_params._dict
-        results_query = (
-            db.query(models.CChannelOrder)
-            .join(models.CChannelOrderDetails)
-            .order_by(models.CChannelOrderDetails.pick_up_time.asc())
-            .filter(
-                models.CChannelOrderDetails.production_stage != ProductionStage.done
-            )
-            .join(models.Customer)
-            .filter_by(**query_params)
+        query_params = search_filters(request)
+        results_query = page.query(
+            not_done_orders(db).join(models.Customer).filter_by(**query_params)
         )
 
-        return results_query.all()
+        return page.orders(results_query.all(), response)
     except exc.InvalidRequestError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -106,7 +120,7 @@ async def get_images(
     db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
-    query = db.query(models.CChannelOrderDetails).get(id)
+    query = await run_db(db.query(models.CChannelOrderDetails).get, id)
     if query is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -120,6 +134,8 @@ async def get_images(
     "/orders/delete/{id}",
     description="delete the existing order",
     status_code=status.HTTP_204_NO_CONTENT,
+    # an empty body, and the headers get_db set on the response, like the read after write cookie.
+    response_class=Response,
 )
 def delete_an_order(
     id: int,
@@ -146,7 +162,31 @@ def delete_an_order(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"The order is either done or producing and it cannot be stopped.",
         )
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    return
+
+
+def save_order(db: Session, order: c_channel_schema.CChannelOrderCreate) -> int:
+    # TODO: replace manager_id.
+    new_order = models.CChannelOrder(manager_id=1, customer_id=order.customer_id)
+    new_order.cchannel_order_detail = models.CChannelOrderDetails(
+        **order.cchannel_order_detail.dict()
+    )
+    db.add(new_order)
+    db.commit()
+    db.refresh(new_order)
+    return new_order.id
+
+
+def save_holes_path(db: Session, order_id: int, holes_path: str):
+    db.query(models.CChannelOrderDetails).filter(
+        models.CChannelOrderDetails.cchannel_order_id == order_id
+    ).update(
+        {
+            models.CChannelOrderDetails.holes: holes_path,
+        },
+        synchronize_session=False,
+    )
+    db.commit()
 
 
 @cchannel_orders_router.post("/create")
@@ -184,17 +224,7 @@ async def create_order(
             customer_id=customer_id,
             cchannel_order_detail=order_detail_scheme,
         )
-        # TODO: replace manager_id.
-        new_order = models.CChannelOrder(
-            manager_id=1, customer_id=pydantic_scheme.customer_id
-        )
-        new_order.cchannel_order_detail = models.CChannelOrderDetails(
-            **pydantic_scheme.cchannel_order_detail.dict()
-        )
-        db.add(new_order)
-        db.commit()
-        db.refresh(new_order)
-        new_order_id = new_order.id
+        new_order_id = await run_db(save_order, db, pydantic_scheme)
         if file:
             file_type = file.content_type.split("/")
             if "image" not in file_type:
@@ -208,15 +238,7 @@ async def create_order(
                 file,
                 holes_path,
             )
-            db.query(models.CChannelOrderDetails).filter(
-                models.CChannelOrderDetails.cchannel_order_id == new_order_id
-            ).update(
-                {
-                    models.CChannelOrderDetails.holes: str(holes_path),
-                },
-                synchronize_session=False,
-            )
-            db.commit()
+            await run_db(save_holes_path, db, new_order_id, str(holes_path))
 
     except HTTPException as e:
         raise e
@@ -1,12 +1,22 @@
 import asyncio
 
 from factory import models, oauth2
-from factory.database import get_db
+from factory.config import settings
+from factory.database import get_db, read_only
+from factory.pagination import OrderPage, search_filters
 from factory.schema import ds_schema, orders_update_schema, token_schema
 from factory.utils import ProductionStage
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
 from sqlalchemy import exc
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager, selectinload
 
 ds_orders_router = APIRouter(
     prefix="/ds",
@@ -14,46 +24,60 @@ ds_orders_router = APIRouter(
 )
 
 
+def not_done_orders(db: Session):
+    # everything DSOrderOut reads comes in three queries, whatever the number of orders.
+    # the detail is joined for the filter anyway, the few customers and managers are loaded by id.
+    return (
+        db.query(models.DSOrder)
+        .join(models.DSOrderDetails)
+        .options(
+            contains_eager(models.DSOrder.ds_order_detail),
+            selectinload(models.DSOrder.ds_customer),
+            selectinload(models.DSOrder.ds_manager),
+        )
+        .filter(models.DSOrderDetails.production_stage != ProductionStage.done)
+    )
+
+
 @ds_orders_router.get(
     "/orders/all",
-    description="The data is sorted by pick_up_time by default.",
+    description="The data is sorted by pick_up_time by default. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
     response_model=list[ds_schema.DSOrderOut],
+    dependencies=[Depends(read_only)],
 )
 def get_all_orders(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
     db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
-    results = (
-        db.query(models.DSOrder)
-        .join(models.DSOrderDetails)
-        .order_by(models.DSOrderDetails.pick_up_time.asc())
-        .filter(models.DSOrderDetails.production_stage != ProductionStage.done)
-    ).all()
-    return results
+    page = OrderPage(models.DSOrder.ds_order_detail, cursor, limit)
+    return page.orders(page.query(not_done_orders(db)).all(), response)
 
 
 @ds_orders_router.get(
     "/orders/search/customer_info",
-    description="Search orders by customer info. Output will be sorted with most recent pick_up_time",
+    description="Search orders by customer info. Output will be sorted with most recent pick_up_time. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
     response_model=list[ds_schema.DSOrderOut],
+    dependencies=[Depends(read_only)],
 )
 def search_order(
     request: Request,
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
     db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
+    page = OrderPage(models.DSOrder.ds_order_detail, cursor, limit)
     try:
-        query_params = request.query_params._dict
-        results_query = (
-            db.query(models.DSOrder)
-            .join(models.DSOrderDetails)
-            .order_by(models.DSOrderDetails.pick_up_time.asc())
-            .filter(models.DSOrderDetails.production_stage != ProductionStage.done)
-            .join(models.Customer)
-            .filter_by(**query_params)
+        query_params = search_filters(request)
+        results_query = page.query(
+            not_done_orders(db).join(models.Customer).filter_by(**query_params)
         )
 
-        return results_query.all()
+        return page.orders(results_query.all(), response)
     except exc.InvalidRequestError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -84,12 +108,12 @@ def update_an_order(
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
     order_query = db.query(models.DSOrderDetails).filter(models.DSOrderDetails.id == id)
-    if order_query.first() is None:
+    # the rows are not loaded first, models.receive_do_orm_execute logs and publishes the stage change.
+    if not order_query.update(order.dict(), synchronize_session=False):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Connect to the Admin.",
         )
-    order_query.update(order.dict(), synchronize_session=False)
     db.commit()
     return
 
@@ -98,6 +122,8 @@ def update_an_order(
     "/orders/delete/{id}",
     description="delete the existing order",
     status_code=status.HTTP_204_NO_CONTENT,
+    # an empty body, and the headers get_db set on the response, like the read after write cookie.
+    response_class=Response,
 )
 def delete_an_order(
     id: int,
@@ -121,7 +147,7 @@ def delete_an_order(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"The order is either done or producing and it cannot be stopped.",
         )
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    return
 
 
 # # TODO: this has to change to stream location.
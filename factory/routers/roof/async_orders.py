@@ -0,0 +1,158 @@
+from factory import models, oauth2
+from factory.async_database import get_db
+from factory.config import settings
+from factory.database import read_only
+from factory.pagination import OrderPage, search_filters
+from factory.schema import orders_update_schema, roof_schema, token_schema
+from factory.utils import ProductionStage
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from sqlalchemy import exc, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, selectinload
+
+# the routes of factory.routers.roof.orders on an AsyncSession, mounted instead of them when db_async is on.
+roof_orders_router = APIRouter(
+    prefix="/roof",
+    tags=["Roof"],
+)
+
+
+def not_done_orders():
+    # everything RoofOrderOut reads is loaded here, an async session cannot load it lazily later.
+    return (
+        select(models.RoofOrder)
+        .join(models.RoofOrderDetails)
+        .options(
+            contains_eager(models.RoofOrder.roof_order_detail),
+            selectinload(models.RoofOrder.roof_customer),
+            selectinload(models.RoofOrder.roof_manager),
+        )
+        .filter(models.RoofOrderDetails.production_stage != ProductionStage.done)
+    )
+
+
+@roof_orders_router.get(
+    "/orders/all",
+    description="The data is sorted by pick_up_time by default. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
+    response_model=list[roof_schema.RoofOrderOut],
+    dependencies=[Depends(read_only)],
+)
+async def get_all_orders(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    page = OrderPage(models.RoofOrder.roof_order_detail, cursor, limit)
+    results = await db.execute(page.query(not_done_orders()))
+    return page.orders(results.scalars().all(), response)
+
+
+@roof_orders_router.get(
+    "/orders/search/customer_info",
+    description="earch orders by customer info. Output will be sorted with most recent pick_up_time. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
+    response_model=list[roof_schema.RoofOrderOut],
+    dependencies=[Depends(read_only)],
+)
+async def search_order(
+    request: Request,
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    page = OrderPage(models.RoofOrder.roof_order_detail, cursor, limit, descending=True)
+    try:
+        query_params = search_filters(request)
+        results_query = page.query(
+            not_done_orders().join(models.Customer).filter_by(**query_params)
+        )
+    except exc.InvalidRequestError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invaild Search Query. Check the parameters again.",
+        )
+    results = await db.execute(results_query)
+    return page.orders(results.scalars().all(), response)
+
+
+@roof_orders_router.post("/create")
+async def create_an_order(
+    order: roof_schema.RoofOrderCreate,
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_issuer),
+):
+    new_order = models.RoofOrder(
+        manager_id=manager_info.manager_id, customer_id=order.customer_id
+    )
+    new_order.roof_order_detail = models.RoofOrderDetails(
+        **order.roof_order_detail.dict()
+    )
+
+    db.add(new_order)
+    await db.commit()
+
+
+@roof_orders_router.put("/orders/details/update/{id}")
+async def update_an_order(
+    id: int,
+    order: orders_update_schema.OrderDetailUpdate,
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_issuer),
+):
+    # models.receive_do_orm_execute logs and publishes the stage change, like for the sync routes.
+    result = await db.execute(
+        update(models.RoofOrderDetails)
+        .where(models.RoofOrderDetails.id == id)
+        .values(order.dict())
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Connect to the Admin.",
+        )
+    await db.commit()
+    return
+
+
+@roof_orders_router.delete(
+    "/orders/delete/{id}",
+    description="delete the existing order",
+    status_code=status.HTTP_204_NO_CONTENT,
+    # an empty body, and the headers get_db set on the response, like the read after write cookie.
+    response_class=Response,
+)
+async def delete_an_order(
+    id: int,
+    db: AsyncSession = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_issuer),
+):
+    order_to_delete: models.RoofOrder = await db.get(
+        models.RoofOrder, id, options=[selectinload(models.RoofOrder.roof_order_detail)]
+    )
+    if order_to_delete is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The order does not exist.",
+        )
+    # use this method to catch order object to be deleted in event listener (before_delete).
+    if order_to_delete.roof_order_detail.production_stage == ProductionStage.pending:
+        await db.delete(order_to_delete)
+        await db.commit()
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="The order is either done or producing and it cannot be stopped.",
+        )
+    return
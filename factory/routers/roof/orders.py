@@ -1,10 +1,20 @@
 from factory import models, oauth2
-from factory.database import get_db
+from factory.config import settings
+from factory.database import get_db, read_only
+from factory.pagination import OrderPage, search_filters
 from factory.schema import orders_update_schema, roof_schema, token_schema
 from factory.utils import ProductionStage
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
 from sqlalchemy import exc
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager, selectinload
 
 roof_orders_router = APIRouter(
     prefix="/roof",
@@ -12,48 +22,60 @@ roof_orders_router = APIRouter(
 )
 
 
+def not_done_orders(db: Session):
+    # everything RoofOrderOut reads comes in three queries, whatever the number of orders.
+    # the detail is joined for the filter anyway, the few customers and managers are loaded by id.
+    return (
+        db.query(models.RoofOrder)
+        .join(models.RoofOrderDetails)
+        .options(
+            contains_eager(models.RoofOrder.roof_order_detail),
+            selectinload(models.RoofOrder.roof_customer),
+            selectinload(models.RoofOrder.roof_manager),
+        )
+        .filter(models.RoofOrderDetails.production_stage != ProductionStage.done)
+    )
+
+
 @roof_orders_router.get(
     "/orders/all",
-    description="The data is sorted by pick_up_time by default.",
+    description="The data is sorted by pick_up_time by default. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
     response_model=list[roof_schema.RoofOrderOut],
+    dependencies=[Depends(read_only)],
 )
 def get_all_orders(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
     db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
-    results = (
-        db.query(models.RoofOrder)
-        .join(
-            models.RoofOrderDetails,
-        )
-        .order_by(models.RoofOrderDetails.pick_up_time.asc())
-        .filter(models.RoofOrderDetails.production_stage != ProductionStage.done)
-    ).all()
-    return results
+    page = OrderPage(models.RoofOrder.roof_order_detail, cursor, limit)
+    return page.orders(page.query(not_done_orders(db)).all(), response)
 
 
 @roof_orders_router.get(
     "/orders/search/customer_info",
-    description="earch orders by customer info. Output will be sorted with most recent pick_up_time",
+    description="earch orders by customer info. Output will be sorted with most recent pick_up_time. A page at a time, the cursor of the next page is in the X-Next-Cursor header.",
     response_model=list[roof_schema.RoofOrderOut],
+    dependencies=[Depends(read_only)],
 )
 def search_order(
     request: Request,
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(settings.orders_page_size, gt=0),
     db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
+    page = OrderPage(models.RoofOrder.roof_order_detail, cursor, limit, descending=True)
     try:
-        query_params = request.query_params._dict
-        results_query = (
-            db.query(models.RoofOrder)
-            .join(models.RoofOrderDetails)
-            .order_by(models.RoofOrderDetails.pick_up_time.desc())
-            .filter(models.RoofOrderDetails.production_stage != ProductionStage.done)
-            .join(models.Customer)
-            .filter_by(**query_params)
+        query_params = search_filters(request)
+        results_query = page.query(
+            not_done_orders(db).join(models.Customer).filter_by(**query_params)
         )
 
-        return results_query.all()
+        return page.orders(results_query.all(), response)
     except exc.InvalidRequestError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -88,12 +110,12 @@ def update_an_order(
     order_query = db.query(models.RoofOrderDetails).filter(
         models.RoofOrderDetails.id == id
     )
-    if order_query.first() is None:
+    # the rows are not loaded first, models.receive_do_orm_execute logs and publishes the stage change.
+    if not order_query.update(order.dict(), synchronize_session=False):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Connect to the Admin.",
         )
-    order_query.update(order.dict(), synchronize_session=False)
     db.commit()
     return
 
@@ -102,6 +124,8 @@ def update_an_order(
     "/orders/delete/{id}",
     description="delete the existing order",
     status_code=status.HTTP_204_NO_CONTENT,
+    # an empty body, and the headers get_db set on the response, like the read after write cookie.
+    response_class=Response,
 )
 def delete_an_order(
     id: int,
@@ -125,4 +149,4 @@ def delete_an_order(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"The order is either done or producing and it cannot be stopped.",
         )
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    return
@@ -1,24 +1,283 @@
-from fastapi import WebSocket
-from websockets.exceptions import ConnectionClosedError
+import asyncio
+import time
+from collections import Counter, defaultdict, deque
+from typing import Callable
 
+from factory.config import settings
+from factory.schema.stream_schema import (
+    OrderEvent,
+    OrderEventMessage,
+    StreamSubscription,
+)
+from fastapi import WebSocket, WebSocketDisconnect
+from websockets.exceptions import ConnectionClosed
+
+
+class Listener:
+    """one connection with its own outbound queue, emptied by its own writer task."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        queue_size: int,
+        manager_id: int | None = None,
+        heartbeat: bool = False,
+    ):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task | None = None
+        self.subscription: StreamSubscription | None = None
+        # None for a listener without a token, it only counts toward max_connections.
+        self.manager_id = manager_id
+        # only the listeners that asked for them get the pings, and have to answer them.
+        self.heartbeat = heartbeat
+        # anything heard from the client, the heartbeats ask for a pong.
+        self.last_seen = time.monotonic()
+
+    def topics(self) -> list[tuple[str, object]]:
+        """(kind, value) keys of the subscription index, value None matches anything of that kind."""
+        topics = []
+        for kind, values in (
+            ("product", self.subscription.products),
+            ("stage", self.subscription.stages),
+            ("customer", self.subscription.customers),
+        ):
+            topics.extend((kind, value) for value in values or [None])
+        return topics
+
+    def select_counts(self, message: dict) -> dict | None:
+        # only the subscribed products, a delta without any of them is not sent at all.
+        if (
+            self.subscription is None
+            or not self.subscription.products
+            or message.get("type") not in ("snapshot", "delta")
+        ):
+            return message
+        counts = [
+            count
+            for count in message["counts"]
+            if count["product_type"] in self.subscription.products
+        ]
+        if message["type"] == "delta" and not counts:
+            return None
+        return {**message, "counts": counts}
+
+
+class EventSourceSocket:
+    """Stands in for a websocket so an SSE response gets the same queue, writer and subscriptions.
+
+    holds one message at a time, a reader that falls behind fills its queue in the manager.
+    """
 
-class ConnectionManager:
     def __init__(self):
-        self.active_connections: list[WebSocket] = []
+        self.messages: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        await self.messages.put(message)
+
+    async def close(self):
+        # the response stops when it reads None.
+        while not self.messages.empty():
+            self.messages.get_nowait()
+        self.messages.put_nowait(None)
+
 
-    async def connect(self, websocket: WebSocket):
+class ConnectionManager:
+    def __init__(
+        self,
+        queue_size: int = settings.stream_queue_size,
+        overflow_policy: str = settings.stream_overflow_policy,
+        max_connections: int = settings.stream_max_connections,
+        max_connections_per_manager: int = settings.stream_max_connections_per_manager,
+        heartbeat_interval: int = settings.stream_heartbeat_interval,
+        idle_timeout: int = settings.stream_idle_timeout,
+    ):
+        self.active_connections: dict[WebSocket, Listener] = {}
+        # topic -> subscribed sockets, so an order event only visits the listeners it matches.
+        self.subscriptions: dict[tuple[str, object], set[WebSocket]] = defaultdict(set)
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.max_connections = max_connections
+        self.max_connections_per_manager = max_connections_per_manager
+        self.manager_connections: Counter[int] = Counter()
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.heartbeat: asyncio.Task | None = None
+        # gives the message that replaces everything queued for a slow listener.
+        self.resync: Callable[[], dict] | None = None
+        self.latencies: deque[float] = deque(maxlen=256)
+        self.coalesced = 0
+        self.dropped = 0
+        self.connected_total = 0
+        self.disconnected_total = 0
+        self.reaped = 0
+        self.rejected = 0
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        manager_id: int | None = None,
+        heartbeat: bool = False,
+    ) -> bool:
+        if len(self.active_connections) >= self.max_connections or (
+            manager_id is not None
+            and self.manager_connections[manager_id] >= self.max_connections_per_manager
+        ):
+            self.rejected += 1
+            return False
         await websocket.accept()
-        self.active_connections.append(websocket)
+        listener = Listener(websocket, self.queue_size, manager_id, heartbeat)
+        listener.writer = asyncio.create_task(self.write(listener))
+        self.active_connections[websocket] = listener
+        if manager_id is not None:
+            self.manager_connections[manager_id] += 1
+        self.connected_total += 1
+        if self.heartbeat is None:
+            self.heartbeat = asyncio.create_task(self.beat())
+        return True
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        listener = self.active_connections.pop(websocket, None)
+        if listener is None:
+            return
+        self.disconnected_total += 1
+        if listener.manager_id is not None:
+            self.manager_connections[listener.manager_id] -= 1
+            if not self.manager_connections[listener.manager_id]:
+                del self.manager_connections[listener.manager_id]
+        self.unsubscribe(listener)
+        if listener.writer is not asyncio.current_task():
+            listener.writer.cancel()
+
+    def touch(self, websocket: WebSocket):
+        listener = self.active_connections.get(websocket)
+        if listener is not None:
+            listener.last_seen = time.monotonic()
+
+    async def beat(self):
+        """pings the listeners that asked for heartbeats and closes the ones that did not answer within idle_timeout.
+
+        the others are left to the ping frames of the server, a dead one fails its receive and disconnects.
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            deadline = time.monotonic() - self.idle_timeout
+            for websocket, listener in list(self.active_connections.items()):
+                if not listener.heartbeat:
+                    continue
+                if listener.last_seen < deadline:
+                    self.reaped += 1
+                    self.disconnect(websocket)
+                    asyncio.create_task(websocket.close())
+                else:
+                    self.send(websocket, {"type": "ping"})
+
+    async def stop(self):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+
+    def subscribe(self, websocket: WebSocket, subscription: StreamSubscription):
+        listener = self.active_connections.get(websocket)
+        if listener is None:
+            return
+        self.unsubscribe(listener)
+        listener.subscription = subscription
+        for topic in listener.topics():
+            self.subscriptions[topic].add(websocket)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
+    def unsubscribe(self, listener: Listener):
+        if listener.subscription is None:
+            return
+        for topic in listener.topics():
+            self.subscriptions[topic].discard(listener.websocket)
+            if not self.subscriptions[topic]:
+                del self.subscriptions[topic]
+        listener.subscription = None
+
+    def subscribers(self, order_event: OrderEvent) -> set[WebSocket]:
+        """listeners whose subscription matches the event in every kind."""
+        values = {
+            "product": [order_event.product_type],
+            "stage": [order_event.production_stage, order_event.previous_stage],
+            "customer": [order_event.customer_id],
+        }
+        matched = None
+        for kind, kind_values in values.items():
+            sockets = set(self.subscriptions.get((kind, None), ()))
+            for value in kind_values:
+                sockets |= self.subscriptions.get((kind, value), set())
+            matched = sockets if matched is None else matched & sockets
+            if not matched:
+                break
+        return matched
+
+    async def write(self, listener: Listener):
+        while True:
+            queued_at, message = await listener.queue.get()
             try:
-                await connection.send_json(message)
-            except ConnectionClosedError:
-                self.active_connections.remove(connection)
+                await listener.websocket.send_json(message)
+            except (ConnectionClosed, WebSocketDisconnect, RuntimeError):
+                self.disconnect(listener.websocket)
+                return
+            self.latencies.append(time.perf_counter() - queued_at)
+
+    def send(self, websocket: WebSocket, message):
+        listener = self.active_connections.get(websocket)
+        if listener is None:
+            return
+        message = listener.select_counts(message)
+        if message is None:
+            return
+        item = (time.perf_counter(), message)
+        try:
+            listener.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow_policy == "drop":
+                self.dropped += 1
+                self.disconnect(websocket)
+                asyncio.create_task(websocket.close())
+                return
+            self.coalesced += 1
+            while not listener.queue.empty():
+                listener.queue.get_nowait()
+            if self.resync is not None:
+                item = (item[0], listener.select_counts(self.resync()))
+            listener.queue.put_nowait(item)
+
+    async def broadcast(self, message):
+        # only queues the message, every writer sends on its own pace.
+        for websocket in list(self.active_connections):
+            self.send(websocket, message)
+
+    async def route(self, order_event: OrderEvent):
+        message = OrderEventMessage(order=order_event).dict(exclude={"order": {"txid"}})
+        for websocket in self.subscribers(order_event):
+            self.send(websocket, message)
+
+    def metrics(self) -> dict:
+        depths = [
+            listener.queue.qsize() for listener in self.active_connections.values()
+        ]
+        latencies = list(self.latencies)
+        return {
+            "connections": len(depths),
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_total": sum(depths),
+            "broadcast_latency_avg_ms": sum(latencies) / len(latencies) * 1000
+            if latencies
+            else 0,
+            "broadcast_latency_max_ms": max(latencies, default=0) * 1000,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "connected_total": self.connected_total,
+            "disconnected_total": self.disconnected_total,
+            "reaped": self.reaped,
+            "rejected": self.rejected,
+        }
 
 
 con_manager = ConnectionManager()
@@ -0,0 +1,114 @@
+import asyncio
+import secrets
+from collections import deque
+
+from factory.config import settings
+from factory.counters import order_counter
+from factory.events import order_bus
+from factory.schema import stream_schema
+
+from .connection_manager import ConnectionManager, con_manager
+
+
+class OrderCountProducer:
+    """The only task that reads the order counter. It reads once per change and fans the result out to every listener.
+
+    listeners get a snapshot when they connect and after that only the products whose count changed.
+    every change gets the next seq, so a listener coming back can ask for the changes it missed.
+    """
+
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        # a slow listener which missed a change needs the whole board again.
+        self.manager.resync = self.snapshot_message
+        # seq starts again at 0 when the process restarts, epoch tells the listeners.
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.counts: dict[str, int] = {}
+        self.history: deque[dict] = deque(maxlen=settings.stream_history_size)
+        self.events: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        self.events = order_bus.subscribe()
+        order_bus.add_resync(self.resync)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.events is not None:
+            order_bus.remove_resync(self.resync)
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.events is not None:
+            order_bus.unsubscribe(self.events)
+            self.events = None
+
+    def message(self, type: str, counts: dict[str, int]) -> dict:
+        return stream_schema.StreamMessage(
+            type=type,
+            epoch=self.epoch,
+            seq=self.seq,
+            counts=[
+                stream_schema.OrderCount(product_type=product, count=count)
+                for product, count in counts.items()
+            ],
+        ).dict()
+
+    def snapshot_message(self) -> dict:
+        return self.message("snapshot", self.counts)
+
+    async def update(self):
+        counts = order_counter.open_orders()
+        changed = {
+            product: counts.get(product, 0)
+            for product in counts.keys() | self.counts.keys()
+            if counts.get(product, 0) != self.counts.get(product, 0)
+        }
+        self.counts = counts
+        if not changed:
+            return
+        self.seq += 1
+        delta = self.message("delta", changed)
+        self.history.append(delta)
+        await self.manager.broadcast(delta)
+
+    async def resync(self):
+        """the counts were taken again, every listener gets the whole board."""
+        await self.update()
+        await self.manager.broadcast(self.snapshot_message())
+
+    def resume(self, epoch: str | None, last_seq: int | None) -> list[dict]:
+        """the messages a listener needs, given the last seq it has seen."""
+        oldest = self.history[0]["seq"] if self.history else self.seq + 1
+        if (
+            epoch == self.epoch
+            and last_seq is not None
+            and oldest - 1 <= last_seq <= self.seq
+        ):
+            missed = [delta for delta in self.history if delta["seq"] > last_seq]
+            # more than the queue of the listener holds would overflow it on the way back in.
+            if len(missed) <= self.manager.queue_size:
+                return missed
+        return [self.snapshot_message()]
+
+    async def wait_for_change(self) -> list[stream_schema.OrderEvent]:
+        order_events = []
+        if settings.stream_mode == "poll":
+            await asyncio.sleep(settings.stream_delay_time)
+        else:
+            order_events.append(await self.events.get())
+        # a burst of orders only needs one recount.
+        while not self.events.empty():
+            order_events.append(self.events.get_nowait())
+        return order_events
+
+    async def run(self):
+        # counting even without listeners keeps the history complete for the ones coming back.
+        while True:
+            await self.update()
+            for order_event in await self.wait_for_change():
+                await self.manager.route(order_event)
+
+
+order_count_producer = OrderCountProducer(con_manager)
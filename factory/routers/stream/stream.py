@@ -1,16 +1,43 @@
 import asyncio
+import json
+from datetime import datetime
 
 from factory import models, oauth2, utils
+from factory.audit import audit_writer
+from factory.board import board_at
 from factory.config import settings
-from factory.database import get_db
+from factory.counters import order_counter
+from factory.database import (
+    SessionLocal,
+    engine,
+    get_db,
+    read_only,
+    replica,
+    replica_engine,
+)
+from factory.monitor import loop_monitor
 from factory.schema import stream_schema, token_schema
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
-from sqlalchemy import func
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query as OrmQuery
 from sqlalchemy.orm import Session
 
-from .connection_manager import con_manager
+from .connection_manager import EventSourceSocket, con_manager
+from .producer import order_count_producer
 
-stream_router = APIRouter(prefix="/stream")
+# nothing here writes, the routes read the replica when there is one.
+stream_router = APIRouter(prefix="/stream", dependencies=[Depends(read_only)])
 
 
 @stream_router.get(
@@ -19,18 +46,12 @@ stream_router = APIRouter(prefix="/stream")
     response_model=str,
 )
 def check_order_count(
-    db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(
         oauth2.get_listener,
     ),
 ):
-    data = (
-        db.query(func.count(models.Transcation.id))
-        .filter(models.Transcation.transcation_type != utils.TransType.update)
-        .all()
-    )
-    # as it returns as a tuple.[(x,)]
-    return data[0][0]
+    # kept up to date by the order events, no need to count transcations.
+    return order_counter.transcations
 
 
 @stream_router.get(
@@ -42,79 +63,296 @@ def get_order_from_trans(
     db: Session = Depends(get_db),
     manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
-    data: models.Transcation = db.query(models.Transcation).get(id)
+    # the view answers for the old three table logs and the jsonb audits alike.
+    data: models.OrderHistory = db.query(models.OrderHistory).get(id)
     return data
 
 
+def history_query(
+    db: Session,
+    products: list[utils.Product],
+    transcation_types: list[utils.TransType],
+    stages: list[utils.ProductionStage],
+    since: datetime | None,
+    until: datetime | None,
+    after: tuple[datetime, int] | None,
+) -> OrmQuery:
+    history = models.OrderHistory
+    query = db.query(history)
+    if products:
+        query = query.filter(history.product_type.in_(products))
+    if transcation_types:
+        query = query.filter(history.transcation_type.in_(transcation_types))
+    if stages:
+        query = query.filter(history.production_stage.in_(stages))
+    # a time range also leaves the order_audits partitions outside of it alone.
+    if since:
+        query = query.filter(history.modified_at >= since)
+    if until:
+        query = query.filter(history.modified_at < until)
+    if after:
+        query = query.filter(tuple_(history.modified_at, history.id) < after)
+    # newest first, a change logged while paging lands before the cursor, never inside the pages left.
+    return query.order_by(history.modified_at.desc(), history.id.desc())
+
+
+def export_history(bind, page_size: int, after: tuple[datetime, int] | None, **filters):
+    # a short session per page, an export of months does not hold a transaction open the whole time.
+    while True:
+        with SessionLocal(bind=bind) as db:
+            entries = history_query(db, after=after, **filters).limit(page_size).all()
+            lines = "".join(
+                stream_schema.HistoryEntry.from_orm(entry).json() + "\n"
+                for entry in entries
+            )
+        if lines:
+            yield lines
+        if len(entries) < page_size:
+            return
+        after = (entries[-1].modified_at, entries[-1].id)
+
+
+@stream_router.get(
+    "/history",
+    description="order changes newest first with their details, a page at a time or all of them as ndjson with format=ndjson.",
+    response_model=stream_schema.HistoryPage,
+)
+def get_order_history(
+    products: list[utils.Product] = Query([]),
+    transcation_types: list[utils.TransType] = Query([]),
+    stages: list[utils.ProductionStage] = Query([]),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = Query(settings.history_page_size, gt=0),
+    format: str = Query("json", regex="^(json|ndjson)$"),
+    db: Session = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    # the order_history view already carries the detail of the change, a page is one query.
+    try:
+        after = utils.decode_cursor(cursor) if cursor else None
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    filters = dict(
+        products=products,
+        transcation_types=transcation_types,
+        stages=stages,
+        since=since,
+        until=until,
+    )
+    limit = min(limit, settings.history_max_page_size)
+    if format == "ndjson":
+        # starts at the cursor and goes on to the oldest change, limit is the size of each query.
+        # on the database get_db picked, the replica or the primary.
+        return StreamingResponse(
+            export_history(db.get_bind(), limit, after, **filters),
+            media_type="application/x-ndjson",
+        )
+    entries = history_query(db, after=after, **filters).limit(limit).all()
+    next_cursor = None
+    if len(entries) == limit:
+        next_cursor = utils.encode_cursor(entries[-1].modified_at, entries[-1].id)
+    return {"entries": entries, "next_cursor": next_cursor}
+
+
+@stream_router.get(
+    "/board",
+    description="the orders per product and stage and the orders not done yet, at a moment of the past or now.",
+    response_model=stream_schema.OrderBoard,
+)
+def get_order_board(
+    at: datetime | None = None,
+    db: Session = Depends(get_db),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    # a moment without a time zone is read in the local time of the shop.
+    if at is None:
+        at = datetime.now().astimezone(utils.LOCAL_TIME_ZONE)
+    elif at.tzinfo is None:
+        at = utils.LOCAL_TIME_ZONE.localize(at)
+    board = board_at(db, at)
+    return {
+        "at": at,
+        "checkpoint_at": board.checkpoint_at,
+        "replayed": board.replayed,
+        "counts": [
+            {"product_type": product, "count": count}
+            for product, count in board.open_orders().items()
+        ],
+        "stages": [
+            {"product_type": product, "production_stage": stage, "count": count}
+            for (product, stage), count in board.counts.items()
+            if count
+        ],
+        "orders": [
+            {"product_type": product, "order_id": order_id, "production_stage": stage}
+            for (product, order_id), stage in sorted(
+                board.orders.items(), key=lambda order: order[0][1]
+            )
+        ],
+    }
+
+
+def async_pool_metrics() -> dict:
+    if not settings.db_async:
+        return {}
+    from factory.async_database import async_engine
+
+    return async_engine.sync_engine.pool.metrics("db_async_pool")
+
+
+def replica_metrics() -> dict:
+    if replica_engine is None:
+        return {}
+    return {**replica_engine.pool.metrics("db_replica_pool"), **replica.metrics()}
+
+
+@stream_router.get(
+    "/metrics",
+    description="listeners, their queued messages, how long a broadcast takes to reach them, how long the event loop was blocked, how far the audit writer is behind and how busy the connection pools are and whether the replica is up.",
+    response_model=stream_schema.StreamMetrics,
+)
+def get_stream_metrics(
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    return {
+        **con_manager.metrics(),
+        **loop_monitor.metrics(),
+        **audit_writer.metrics(),
+        **engine.pool.metrics(),
+        **async_pool_metrics(),
+        **replica_metrics(),
+    }
+
+
 ## INSERT_WITHOUT_DONE - DEL - UPDATE_WITH_DONE = CURRENT NON-DONE NUMBER OF ORDERS
 ## even tho we wrote prefix for stream router as '/stream' at the top, we need to add here again as WEBSOCKET DOES NOT RECOGNIZE THE PREFIX FROM APIROUTER CLASS.
 @stream_router.websocket("/stream/listen")
 async def stream_all_new_order(
     websoc: WebSocket,
-    db: Session = Depends(get_db),
+    epoch: str | None = None,
+    last_seq: int | None = None,
+    token: str | None = None,
+    heartbeat: bool = False,
     # manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
 ):
-    await con_manager.connect(websocket=websoc)
+    # the counts come from order_count_producer, this handler only keeps the socket.
+    # a listener coming back sends the epoch and seq of its last message to get only what it missed.
+    # a listener can send a StreamSubscription at any time to only get the products, stages and customers it cares about.
+    # with heartbeat the server also sends {"type": "ping"} every stream_heartbeat_interval,
+    # and closes the listener when it sends nothing back for stream_idle_timeout.
+    # the tablets do not send a token yet, with one the listeners of its manager are capped as well.
+    manager_id = None
+    if token is not None:
+        try:
+            manager_info = oauth2.verify_access_token(token, ValueError())
+        except ValueError:
+            manager_info = None
+        if manager_info is None or not utils.ManagerType.is_listener(
+            manager_info.manager_type
+        ):
+            await websoc.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        manager_id = manager_info.manager_id
+    if not await con_manager.connect(websoc, manager_id, heartbeat):
+        await websoc.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
     try:
-        while len(con_manager.active_connections) > 0:
-            result = (
-                db.query(
-                    models.Transcation.product_type,
-                    func.count(models.Transcation.id).label("count"),
-                )
-                .group_by(models.Transcation.product_type)
-                .filter(
-                    models.Transcation.production_stage != utils.ProductionStage.done
-                )
-                .all()
-            )
-            # total_insert_trans = (
-            #     db.query(
-            #         models.Transcation.product_type,
-            #         func.count(models.Transcation.id).label("count"),
-            #     )
-            #     .group_by(models.Transcation.product_type)
-            #     .filter_by(
-            #         models.Transcation.transcation_type == utils.TransType.insert,
-            #         models.Transcation.product_type != utils.ProductionStage.done,
-            #     )
-            #     .all()
-            # )
-            # total_delete_trans = (
-            #     db.query(
-            #         models.Transcation.product_type,
-            #         func.count(models.Transcation.id).label("count"),
-            #     )
-            #     .group_by(models.Transcation.product_type)
-            #     .filter(models.Transcation.transcation_type == utils.TransType.delete)
-            #     .all()
-            # )
-            # total_updated_trans = (
-            #     db.query(
-            #         models.Transcation.product_type,
-            #         func.count(models.Transcation.id).label("count"),
-            #     )
-            #     .group_by(models.Transcation.product_type)
-            #     .filter_by(
-            #         models.Transcation.transcation_type == utils.TransType.update,
-            #         models.Transcation.production_stage == utils.ProductionStage.done,
-            #     )
-            #     .all()
-            # )
-
-            # total_inserts = [
-            #     stream_schema.OrderCount.from_orm(i) for i in total_insert_trans
-            # ]
-            # total_deletes = [
-            #     stream_schema.OrderCount.from_orm(i) for i in total_delete_trans
-            # ]
-            # total_updates = [
-            #     stream_schema.OrderCount.from_orm(i) for i in total_updated_trans
-            # ]
-
-            final_result = [stream_schema.OrderCount.from_orm(i).dict() for i in result]
-
-            await con_manager.broadcast(final_result)
-            await asyncio.sleep(settings.stream_delay_time)
+        for message in order_count_producer.resume(epoch, last_seq):
+            con_manager.send(websoc, message)
+        while True:
+            text = await websoc.receive_text()
+            con_manager.touch(websoc)
+            try:
+                data = json.loads(text)
+                if not isinstance(data, dict) or data.get("type") == "pong":
+                    continue
+                subscription = stream_schema.StreamSubscription.parse_obj(data)
+            except (ValueError, ValidationError):
+                continue
+            con_manager.subscribe(websoc, subscription)
+            # the board as seen through the new subscription.
+            con_manager.send(websoc, order_count_producer.snapshot_message())
     except WebSocketDisconnect:
         con_manager.disconnect(websoc)
+
+
+def format_event(message: dict) -> str:
+    """a snapshot is one "snapshot" event, a delta one event per product named after it.
+
+    only the last product of a delta has the id "epoch:seq", the ones before it "epoch:seq.i".
+    a client that lost the end of a delta comes back with seq.i and gets the whole delta again.
+    """
+    if message["type"] == "order":
+        return f"event: order\ndata: {json.dumps(message['order'])}\n\n"
+    event_id = f"{message['epoch']}:{message['seq']}"
+    if message["type"] == "snapshot":
+        return f"id: {event_id}\nevent: snapshot\ndata: {json.dumps(message['counts'])}\n\n"
+    last = len(message["counts"]) - 1
+    return "".join(
+        f"id: {event_id if i == last else f'{event_id}.{i}'}\n"
+        f"event: {utils.Product(count['product_type']).name}\ndata: {json.dumps(count)}\n\n"
+        for i, count in enumerate(message["counts"])
+    )
+
+
+def resumed_seq(last_seq: str) -> int | None:
+    """the seq of the last whole message of a Last-Event-ID, a part of a delta counts as the one before it."""
+    seq, part, _ = last_seq.partition(".")
+    if not seq.isdigit():
+        return None
+    return int(seq) - 1 if part else int(seq)
+
+
+@stream_router.get(
+    "/events",
+    description="the websocket stream as server-sent events, for clients behind proxies that break websockets.",
+)
+async def stream_order_events(
+    products: list[utils.Product] = Query([]),
+    stages: list[utils.ProductionStage] = Query([]),
+    customers: list[int] = Query([]),
+    last_event_id: str | None = Header(None),
+    manager_info: token_schema.PayloadData = Depends(oauth2.get_listener),
+):
+    # the browser sends back the id of the last event it got as "epoch:seq" when it reconnects.
+    epoch, _, last_seq = (last_event_id or "").partition(":")
+    socket = EventSourceSocket()
+    if not await con_manager.connect(socket, manager_info.manager_id):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="too many listeners, try again later.",
+        )
+    if products or stages or customers:
+        con_manager.subscribe(
+            socket,
+            stream_schema.StreamSubscription(
+                products=products, stages=stages, customers=customers
+            ),
+        )
+    for message in order_count_producer.resume(epoch or None, resumed_seq(last_seq)):
+        con_manager.send(socket, message)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(
+                        socket.messages.get(), settings.sse_keepalive_time
+                    )
+                except asyncio.TimeoutError:
+                    # proxies close connections that stay quiet for too long.
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield format_event(message)
+        finally:
+            con_manager.disconnect(socket)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
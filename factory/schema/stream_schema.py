@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel
 from factory import utils
 
@@ -11,6 +13,30 @@ class CheckOrderByIdResponse(BaseModel):
         use_enum_values = True
 
 
+class HistoryEntry(BaseModel):
+    """an order change with the detail it was logged with."""
+
+    id: int
+    product_type: utils.Product
+    transcation_type: utils.TransType
+    production_stage: utils.ProductionStage
+    previous_stage: utils.ProductionStage | None
+    order_id: int | None
+    detail: dict | None
+    modified_at: datetime
+
+    class Config:
+        orm_mode = True
+        use_enum_values = True
+
+
+class HistoryPage(BaseModel):
+    """newest first, next_cursor is None on the last page."""
+
+    entries: list[HistoryEntry]
+    next_cursor: str | None
+
+
 class OrderCount(BaseModel):
     product_type: utils.Product
     count: int = 0
@@ -36,3 +62,124 @@ class OrderCount(BaseModel):
     class Config:
         use_enum_values = True
         orm_mode = True
+
+
+class OrderEvent(BaseModel):
+    """published whenever an order is inserted, deleted or changes its stage."""
+
+    product_type: utils.Product
+    transcation_type: utils.TransType
+    production_stage: utils.ProductionStage
+    previous_stage: utils.ProductionStage | None
+    order_id: int | None
+    customer_id: int | None
+    # the transaction that wrote it, the order counter skips the ones its rebuild already counted.
+    txid: int | None
+
+    class Config:
+        use_enum_values = True
+
+
+class StageCount(BaseModel):
+    product_type: utils.Product
+    production_stage: utils.ProductionStage
+    count: int
+
+    class Config:
+        use_enum_values = True
+
+
+class BoardOrder(BaseModel):
+    product_type: utils.Product
+    order_id: int
+    production_stage: utils.ProductionStage
+
+    class Config:
+        use_enum_values = True
+
+
+class OrderBoard(BaseModel):
+    """the board as it was at a moment, replayed from the checkpoint taken at checkpoint_at."""
+
+    at: datetime
+    checkpoint_at: datetime | None
+    replayed: int
+    counts: list[OrderCount]
+    stages: list[StageCount]
+    orders: list[BoardOrder]
+
+
+class StreamMessage(BaseModel):
+    """a snapshot has every product, a delta only the products whose count changed."""
+
+    type: str
+    epoch: str
+    seq: int
+    counts: list[OrderCount]
+
+
+class OrderEventMessage(BaseModel):
+    """sent to the listeners whose subscription matches the order."""
+
+    type: str = "order"
+    order: OrderEvent
+
+
+class StreamSubscription(BaseModel):
+    """sent by a listener to choose its topics, an empty set matches anything.
+
+    products also narrows the counts, so a listener can see gaps in seq.
+    """
+
+    products: set[utils.Product] = set()
+    stages: set[utils.ProductionStage] = set()
+    customers: set[int] = set()
+
+    class Config:
+        use_enum_values = True
+
+
+class StreamMetrics(BaseModel):
+    connections: int
+    queue_depth_max: int
+    queue_depth_total: int
+    broadcast_latency_avg_ms: float
+    broadcast_latency_max_ms: float
+    coalesced: int
+    dropped: int
+    connected_total: int
+    disconnected_total: int
+    reaped: int
+    rejected: int
+    loop_lag_avg_ms: float
+    loop_lag_max_ms: float
+    audit_pending: int
+    audit_written: int
+    audit_lost: int
+    audit_retries: int
+    audit_batch_size_avg: float
+    audit_batch_size_max: int
+    audit_lag_avg_ms: float
+    audit_lag_max_ms: float
+    db_pool_size: int
+    db_pool_checked_out: int
+    db_pool_overflow: int
+    db_pool_wait_avg_ms: float
+    db_pool_wait_max_ms: float
+    db_pool_timeouts: int
+    # the pool of factory.async_database, when db_async is on.
+    db_async_pool_size: int | None
+    db_async_pool_checked_out: int | None
+    db_async_pool_overflow: int | None
+    db_async_pool_wait_avg_ms: float | None
+    db_async_pool_wait_max_ms: float | None
+    db_async_pool_timeouts: int | None
+    # the pool of the read replica and whether the reads go to it, when there is one.
+    db_replica_pool_size: int | None
+    db_replica_pool_checked_out: int | None
+    db_replica_pool_overflow: int | None
+    db_replica_pool_wait_avg_ms: float | None
+    db_replica_pool_wait_max_ms: float | None
+    db_replica_pool_timeouts: int | None
+    db_replica_up: bool | None
+    db_replica_failovers: int | None
@@ -1,3 +1,6 @@
+import base64
+import json
+from datetime import datetime
 from enum import Enum
 from pathlib import WindowsPath
 
@@ -71,6 +74,22 @@ def verify(password, real_password):
     return pwd_context.verify(password, real_password)
 
 
+def encode_cursor(moment: datetime, id: int) -> str:
+    """the keyset of the last row of a page, opaque to the clients."""
+    return base64.urlsafe_b64encode(
+        json.dumps([moment.isoformat(), id]).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """raises ValueError for anything encode_cursor did not make."""
+    try:
+        moment, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(moment), int(id)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"invalid cursor {cursor!r}") from error
+
+
 class DeckSheetEnv:
     # python name mangling
     __depth = {1.5, 2, 3}
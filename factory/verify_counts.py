@@ -0,0 +1,201 @@
+"""Checks the order logs against the live order tables, order by order.
+
+the last logged change of every order is read next to its live detail, both sorted by order id
+through server side cursors, so the memory stays the same for any number of orders.
+updates done in raw sql skip the audit listeners, this finds the orders the logs lost track of.
+run it from cron for example: python -m factory.verify_counts [--repair]
+with --repair every order out of step gets a logged change that brings the logs to the live stage,
+except a deleted order whose last log has no detail, those are only reported.
+it exits with 1 when it found differences and did not repair them.
+the stream counts are rebuilt from the live tables when the app starts, a repair does not publish events.
+"""
+import heapq
+import sys
+from collections import defaultdict
+from itertools import groupby
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from factory import models, utils
+from factory.database import SessionLocal, engine
+
+# rows per round trip of the cursors, and corrections per transaction.
+BATCH = 5000
+
+
+def stream(connection, query):
+    # a named cursor on the server, psycopg2 would fetch the whole result otherwise.
+    return connection.execute(
+        query.execution_options(stream_results=True, max_row_buffer=BATCH)
+    )
+
+
+def logged_orders(connection, product: utils.Product, with_detail: bool):
+    """the last change of every order of the product that has one, by order id."""
+    history = models.OrderHistory
+    columns = [history.order_id, history.transcation_type, history.production_stage]
+    if with_detail:
+        columns.append(history.detail)
+    query = (
+        select(*columns)
+        .distinct(history.order_id)
+        .where(history.product_type == product, history.order_id.isnot(None))
+        .order_by(history.order_id, history.modified_at.desc(), history.id.desc())
+    )
+    return stream(connection, query)
+
+
+def live_orders(connection, plan: models.OrderAuditPlan):
+    """every detail of the product, by order id."""
+    query = select(
+        plan.details.__table__, plan.detail_order_id.label("order_id")
+    ).order_by(plan.detail_order_id)
+    return stream(connection, query)
+
+
+def paired(logged, live):
+    """the logged change and the live detail of each order id, None for the side without one."""
+    merged = heapq.merge(
+        ((row.order_id, 0, row) for row in logged),
+        ((row.order_id, 1, row) for row in live),
+        key=lambda entry: entry[:2],
+    )
+    for order_id, entries in groupby(merged, key=lambda entry: entry[0]):
+        sides = {side: row for _, side, row in entries}
+        yield order_id, sides.get(0), sides.get(1)
+
+
+def correction(plan: models.OrderAuditPlan, logged, live) -> dict | None:
+    """the change that takes the logs of an order from logged to live, None when the logs cannot tell it."""
+    if logged is None:
+        return dict(
+            transcation_type=utils.TransType.insert,
+            production_stage=live.production_stage,
+            detail=live,
+        )
+    if live is None:
+        # the detail is gone with the order, the last logged one stands in for it.
+        values = {key: (logged.detail or {}).get(key) for key in plan.copy.keys}
+        columns = plan.copy.log.__table__.c
+        if any(
+            value is None and not columns[key].nullable for key, value in values.items()
+        ):
+            # logged without its detail, the detail log of the delete would fail the whole batch.
+            return None
+        detail = SimpleNamespace(**values)
+        return dict(
+            transcation_type=utils.TransType.delete,
+            production_stage=logged.production_stage,
+            detail=detail,
+        )
+    return dict(
+        transcation_type=utils.TransType.update,
+        production_stage=live.production_stage,
+        previous_stage=logged.production_stage,
+        detail=live,
+    )
+
+
+def write_corrections(plan: models.OrderAuditPlan, corrections: list[tuple[int, dict]]):
+    with SessionLocal() as db:
+        for order_id, change in corrections:
+            plan.log(db, order_id, **change)
+        db.commit()
+
+
+def verify_product(connection, plan: models.OrderAuditPlan, repair: bool) -> dict:
+    logged_counts = defaultdict(int)
+    live_counts = defaultdict(int)
+    out_of_step = []
+    corrections = []
+    repaired = 0
+    # deleted orders whose logs cannot be closed, the first ten of them.
+    unrepairable = []
+    unrepaired = 0
+    for order_id, logged, live in paired(
+        logged_orders(connection, plan.product, with_detail=repair),
+        live_orders(connection, plan),
+    ):
+        if logged is not None and logged.transcation_type == utils.TransType.delete:
+            logged = None
+        if logged is not None:
+            logged_counts[logged.production_stage] += 1
+        if live is not None:
+            live_counts[live.production_stage] += 1
+        if logged is None and live is None:
+            continue
+        if (
+            logged is not None
+            and live is not None
+            and logged.production_stage == live.production_stage
+        ):
+            continue
+        if len(out_of_step) < 10:
+            out_of_step.append(order_id)
+        if repair:
+            change = correction(plan, logged, live)
+            if change is None:
+                unrepaired += 1
+                if len(unrepairable) < 10:
+                    unrepairable.append(order_id)
+                continue
+            corrections.append((order_id, change))
+            if len(corrections) == BATCH:
+                write_corrections(plan, corrections)
+                repaired += len(corrections)
+                corrections = []
+    if corrections:
+        write_corrections(plan, corrections)
+        repaired += len(corrections)
+    return {
+        "logged": dict(logged_counts),
+        "live": dict(live_counts),
+        "out_of_step": out_of_step,
+        "repaired": repaired,
+        "unrepairable": unrepairable,
+        "unrepaired": unrepaired,
+    }
+
+
+def verify_counts(repair: bool = False) -> bool:
+    """prints the counts that differ per product and stage, True when nothing differed."""
+    in_step = True
+    # one snapshot for the logs and the live tables, orders changing meanwhile do not show up as drift.
+    snapshot = engine.execution_options(isolation_level="REPEATABLE READ")
+    with snapshot.connect() as connection:
+        for plan in models.ORDER_AUDITS.values():
+            report = verify_product(connection, plan, repair)
+            for stage in utils.ProductionStage:
+                logged = report["logged"].get(stage, 0)
+                live = report["live"].get(stage, 0)
+                if logged != live:
+                    in_step = False
+                    print(
+                        f"{plan.product.name} {stage.name}: logged {logged}, live {live}."
+                    )
+            if report["out_of_step"]:
+                in_step = False
+                print(
+                    f"{plan.product.name}: orders out of step like "
+                    f"{', '.join(map(str, report['out_of_step']))}."
+                )
+            if report["repaired"]:
+                print(f"{plan.product.name}: logged {report['repaired']} corrections.")
+            if report["unrepaired"]:
+                print(
+                    f"{plan.product.name}: {report['unrepaired']} deleted orders have no logged detail "
+                    f"to close their logs with, like {', '.join(map(str, report['unrepairable']))}."
+                )
+    if not in_step:
+        print(
+            "running apps count the orders from what they counted at startup, "
+            "restart them to count the live tables again."
+        )
+    return in_step
+
+
+if __name__ == "__main__":
+    repair = "--repair" in sys.argv[1:]
+    if not verify_counts(repair) and not repair:
+        sys.exit(1)
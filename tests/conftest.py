@@ -0,0 +1,54 @@
+"""The tests run on a database of their own, built from the migrations and dropped at the end.
+
+it is named after the database of the settings with _test after it, the one of the settings is never touched.
+every test runs in a transaction that is rolled back.
+"""
+from pathlib import Path
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, text
+
+from factory.config import settings
+
+# before anything builds an engine on the settings.
+settings.db_name = f"{settings.db_name}_test"
+
+from factory.database import SessionLocal, engine  # noqa: E402
+
+ROOT = Path(__file__).parent.parent
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    server = create_engine(
+        engine.url.set(database="postgres"), isolation_level="AUTOCOMMIT"
+    )
+    with server.connect() as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{settings.db_name}"'))
+        connection.execute(text(f'CREATE DATABASE "{settings.db_name}"'))
+    config = Config(str(ROOT / "alembic.ini"))
+    config.set_main_option("script_location", str(ROOT / "ds_alembic"))
+    command.upgrade(config, "head")
+    yield
+    engine.dispose()
+    with server.connect() as connection:
+        connection.execute(text(f'DROP DATABASE "{settings.db_name}"'))
+    server.dispose()
+
+
+@pytest.fixture
+def connection():
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        yield connection
+        if transaction.is_active:
+            transaction.rollback()
+
+
+@pytest.fixture
+def db(connection):
+    db = SessionLocal(bind=connection)
+    yield db
+    db.close()
@@ -0,0 +1,108 @@
+"""The order lists and lookups are served by their indexes, read with EXPLAIN.
+
+the table scans and sorts are priced out of the plans, so the empty database of the tests shows
+the same plans as a big one. what fails is a query the index cannot serve anymore.
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.dialects import postgresql
+
+from factory import models, utils
+from factory.pagination import OrderPage
+from factory.routers.c_channel.orders import not_done_orders as cchannel_orders
+from factory.routers.ds.orders import not_done_orders as ds_orders
+from factory.routers.roof.orders import not_done_orders as roof_orders
+
+# the order, the relationship to its detail and the query of each list.
+ORDERS = {
+    utils.Product.ds: (models.DSOrder, models.DSOrder.ds_order_detail, ds_orders),
+    utils.Product.roof: (
+        models.RoofOrder,
+        models.RoofOrder.roof_order_detail,
+        roof_orders,
+    ),
+    utils.Product.c_channel: (
+        models.CChannelOrder,
+        models.CChannelOrder.cchannel_order_detail,
+        cchannel_orders,
+    ),
+}
+
+
+def plan_nodes(connection, statement) -> list[dict]:
+    """every node of the plan of statement."""
+    # the named parameters are bound again with their types, an enum or a time goes in like the route sends it.
+    compiled = statement.compile(dialect=postgresql.dialect(paramstyle="named"))
+    explain = text(f"EXPLAIN (FORMAT JSON) {compiled}").bindparams(
+        *(
+            bindparam(name, value, type_=compiled.binds[name].type)
+            for name, value in compiled.params.items()
+        )
+    )
+    nodes = [connection.execute(explain).scalar()[0]["Plan"]]
+    for node in nodes:
+        nodes.extend(node.get("Plans", []))
+    return nodes
+
+
+def plans(db, product: utils.Product) -> dict[str, tuple[object, str, bool]]:
+    """the statement and index of each query, and whether the index has to give its order."""
+    order, detail, query = ORDERS[product]
+    details = detail.property.mapper.class_
+    not_done = f"ix_{details.__tablename__}_not_done"
+    # a cursor in the future, the page query has its keyset condition.
+    cursor = utils.encode_cursor(datetime.now().astimezone(utils.LOCAL_TIME_ZONE), 0)
+    # the roof search goes backwards through the same index.
+    search = OrderPage(detail, cursor, 100, descending=product == utils.Product.roof)
+    ((_, order_id),) = detail.property.local_remote_pairs
+    checks = {
+        "list": (
+            OrderPage(detail, None, 100).query(query(db)).statement,
+            not_done,
+            True,
+        ),
+        "next page": (
+            OrderPage(detail, cursor, 100).query(query(db)).statement,
+            not_done,
+            True,
+        ),
+        "search": (
+            search.query(
+                query(db).join(models.Customer).filter_by(name="query check")
+            ).statement,
+            not_done,
+            True,
+        ),
+        "detail of an order": (
+            select(details).where(order_id == 1),
+            f"ix_{details.__tablename__}_{order_id.name}",
+            False,
+        ),
+    }
+    for column in ("customer_id", "manager_id"):
+        checks[f"orders by {column}"] = (
+            select(order).where(getattr(order, column) == 1),
+            f"ix_{order.__tablename__}_{column}",
+            False,
+        )
+    return checks
+
+
+@pytest.mark.parametrize("product", ORDERS, ids=lambda product: product.name)
+def test_queries_use_their_index(db, connection, product):
+    # only for this transaction, a scan or a sort is picked when nothing else can answer the query.
+    connection.execute(text("SET LOCAL enable_seqscan = off"))
+    connection.execute(text("SET LOCAL enable_sort = off"))
+    problems = {}
+    for name, (statement, index, sorted_by_index) in plans(db, product).items():
+        nodes = plan_nodes(connection, statement)
+        indexes = {node["Index Name"] for node in nodes if "Index Name" in node}
+        if index not in indexes:
+            problems[name] = f"does not use {index}, uses {sorted(indexes)}"
+        elif sorted_by_index and any(
+            node["Node Type"] in ("Sort", "Incremental Sort") for node in nodes
+        ):
+            problems[name] = f"sorts the rows instead of reading {index} in order"
+    assert not problems
@@ -0,0 +1,121 @@
+"""The order lists load in the same number of queries for a few orders and for many."""
+from datetime import datetime, timedelta
+from itertools import count
+
+import pytest
+from sqlalchemy import event
+
+from factory import models, utils
+from factory.routers.c_channel.orders import not_done_orders as cchannel_orders
+from factory.routers.ds.orders import not_done_orders as ds_orders
+from factory.routers.roof.orders import not_done_orders as roof_orders
+from factory.schema import c_channel_schema, ds_schema, roof_schema
+
+# orders added before each count, under the 500 ids selectinload puts in one query.
+SIZES = (10, 400)
+
+
+def ds_order(customer, manager, pick_up_time: datetime) -> models.DSOrder:
+    order = models.DSOrder(ds_customer=customer, ds_manager=manager)
+    order.ds_order_detail = models.DSOrderDetails(
+        depth=2,
+        length_per_sheet=2,
+        no_of_sheets=3,
+        total_length=6,
+        thickness=1,
+        zinc_grade=40,
+        pick_up_time=pick_up_time,
+        production_stage=utils.ProductionStage.pending,
+    )
+    return order
+
+
+def roof_order(customer, manager, pick_up_time: datetime) -> models.RoofOrder:
+    order = models.RoofOrder(roof_customer=customer, roof_manager=manager)
+    order.roof_order_detail = models.RoofOrderDetails(
+        color="red",
+        manufacturer=utils.ColorPlainManufacturer.china,
+        length_per_sheet=2,
+        no_of_sheets=3,
+        total_length=6,
+        thickness=1,
+        pick_up_time=pick_up_time,
+        production_stage=utils.ProductionStage.pending,
+    )
+    return order
+
+
+def cchannel_order(customer, manager, pick_up_time: datetime) -> models.CChannelOrder:
+    order = models.CChannelOrder(cchannel_customer=customer, cchannel_manager=manager)
+    order.cchannel_order_detail = models.CChannelOrderDetails(
+        channel_height=2,
+        channel_width=2,
+        length_per_sheet=2,
+        no_of_sheets=3,
+        total_length=6,
+        thickness=1,
+        zinc_grade=40,
+        pick_up_time=pick_up_time,
+        production_stage=utils.ProductionStage.pending,
+    )
+    return order
+
+
+# the query of each list, the response model of its route and a new order of the product.
+LISTS = {
+    utils.Product.ds: (ds_orders, ds_schema.DSOrderOut, ds_order),
+    utils.Product.roof: (roof_orders, roof_schema.RoofOrderOut, roof_order),
+    utils.Product.c_channel: (
+        cchannel_orders,
+        c_channel_schema.CChannelOrderOut,
+        cchannel_order,
+    ),
+}
+
+
+def add_orders(db, new_order, numbers, orders: int):
+    # every order gets its own customer and manager, a relationship loaded lazily shows up as more queries.
+    pick_up_time = datetime.now().astimezone(utils.LOCAL_TIME_ZONE) + timedelta(days=1)
+    for _, i in zip(range(orders), numbers):
+        customer = models.Customer(
+            name="query check", phone=f"999{i:08d}", gender=utils.Gender.male
+        )
+        manager = models.Manager(
+            name=f"query check {i}", password="-", type=utils.ManagerType.listener
+        )
+        db.add(new_order(customer, manager, pick_up_time))
+    db.flush()
+
+
+def count_queries(connection, load) -> int:
+    statements = []
+
+    def counted(*args):
+        statements.append(args)
+
+    event.listen(connection, "before_cursor_execute", counted)
+    try:
+        load()
+    finally:
+        event.remove(connection, "before_cursor_execute", counted)
+    return len(statements)
+
+
+@pytest.mark.parametrize("product", LISTS, ids=lambda product: product.name)
+def test_list_queries_stay_the_same(db, connection, product):
+    query, schema, new_order = LISTS[product]
+    numbers = count()
+    counts = []
+    added = 0
+    for size in SIZES:
+        add_orders(db, new_order, numbers, size - added)
+        added = size
+        # nothing is left in the identity map, the list loads like in a new request.
+        db.expunge_all()
+        counts.append(
+            count_queries(
+                connection,
+                lambda: [schema.from_orm(order) for order in query(db).all()],
+            )
+        )
+    assert counts[0] == counts[1], f"{counts} queries for {list(SIZES)} orders"